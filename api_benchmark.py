@@ -0,0 +1,628 @@
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from client_manager import add_client_hook, get_client, set_endpoint_url
+
+_BUCKET = 'benchmark-bucket'
+_TABLE = 'benchmark-table'
+_TOPIC = 'benchmark-topic'
+_LOG_GROUP = '/benchmark/app'
+_REGION = 'us-east-1'
+_TOPIC_ARN = f'arn:aws:sns:{_REGION}:123456789012:{_TOPIC}'
+# Fixed time range of the log benchmarks, so results are comparable
+_LOG_START = 1700000000000
+_LOG_STOP = _LOG_START + 3600 * 1000
+
+_JSON_THROTTLE = {
+    'dynamodb': 'ProvisionedThroughputExceededException',
+    'cloudwatch-logs': 'ThrottlingException',
+}
+
+
+class _Body(io.BytesIO):
+    """Raw response body, readable both as a stream and in chunks"""
+
+    def stream(self, **kwargs):
+        contents = self.read()
+        while contents:
+            yield contents
+            contents = self.read()
+
+
+class StandIn:
+    """Local stand-in for S3, DynamoDB, SNS and CloudWatch Logs
+
+    Installed as a botocore before-send handler, it answers requests with
+    canned responses after an injected latency, throttling a share of
+    them so the managers' retry and concurrency paths are exercised.
+    Requests are still built, signed and their responses parsed by
+    botocore, so only the network round trip is simulated.
+
+    With passthrough, requests are only delayed (and possibly throttled)
+    before being sent on, e.g. to a local moto server.
+    """
+
+    def __init__(self, latency=0.005, jitter=0.0, throttle_rate=0.0,
+            object_size=1024, objects=500, items=100, log_events=1000,
+            events_per_page=100, passthrough=False, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.object_size = object_size
+        self.objects = objects
+        self.items = items
+        self.log_events = log_events
+        self.events_per_page = events_per_page
+        self.passthrough = passthrough
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._throttles = {}
+
+    def install(self, client):
+        client.meta.events.register('before-send', self.handle,
+            unique_id=f'standin-{id(self)}')
+
+    def counts(self):
+        """Return total requests and throttled requests so far"""
+        with self._lock:
+            return (sum(self._requests.values()),
+                sum(self._throttles.values()))
+
+    def handle(self, request, event_name, **kwargs):
+        _, service, operation = event_name.split('.')[:3]
+        with self._lock:
+            key = f'{service}.{operation}'
+            self._requests[key] = self._requests.get(key, 0) + 1
+            throttled = self._random.random() < self.throttle_rate
+            if throttled:
+                self._throttles[key] = self._throttles.get(key, 0) + 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        time.sleep(delay)
+        if throttled:
+            return self._throttle(request, service)
+        if self.passthrough:
+            return None
+        respond = getattr(self, f'_{service.replace("-", "_")}_{operation}',
+            None)
+        if respond is None:
+            return self._response(request, 200, b'{}')
+        return respond(request)
+
+    def _response(self, request, status, body=b'', headers=None):
+        from botocore.awsrequest import AWSResponse
+
+        headers = dict(headers or {})
+        headers.setdefault('Content-Length', str(len(body)))
+        headers.setdefault('x-amzn-requestid', 'standin')
+        return AWSResponse(request.url, status, headers, _Body(body))
+
+    def _throttle(self, request, service):
+        if service == 's3':
+            return self._response(request, 503,
+                b'<Error><Code>SlowDown</Code>'
+                b'<Message>Please reduce your request rate.</Message></Error>')
+        if service == 'sns':
+            return self._response(request, 400,
+                b'<ErrorResponse><Error><Type>Sender</Type>'
+                b'<Code>Throttling</Code><Message>Rate exceeded</Message>'
+                b'</Error></ErrorResponse>')
+        code = _JSON_THROTTLE.get(service, 'ThrottlingException')
+        return self._response(request, 400,
+            json.dumps({'__type': code, 'message': 'Rate exceeded'}).encode())
+
+    def _json(self, request, data):
+        return self._response(request, 200, json.dumps(data).encode(),
+            {'Content-Type': 'application/x-amz-json-1.0'})
+
+    # S3
+    def _s3_ListBuckets(self, request):
+        return self._response(request, 200, (
+            '<ListAllMyBucketsResult><Buckets><Bucket>'
+            f'<Name>{_BUCKET}</Name>'
+            '<CreationDate>2024-01-01T00:00:00.000Z</CreationDate>'
+            '</Bucket></Buckets></ListAllMyBucketsResult>').encode())
+
+    def _s3_PutObject(self, request):
+        return self._response(request, 200, headers={'ETag': '"standin"'})
+
+    def _s3_HeadObject(self, request):
+        return self._response(request, 200, headers={
+            'Content-Length': str(self.object_size),
+            'ETag': '"standin"',
+            'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'
+        })
+
+    def _s3_GetObject(self, request):
+        return self._response(request, 200, b'0' * self.object_size, {
+            'ETag': '"standin"',
+            'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'
+        })
+
+    def _s3_ListObjectVersions(self, request):
+        versions = ''.join(
+            f'<Version><Key>object-{idx}</Key><VersionId>v{idx}</VersionId>'
+            '<IsLatest>true</IsLatest>'
+            '<LastModified>2024-01-01T00:00:00.000Z</LastModified>'
+            f'<ETag>"standin"</ETag><Size>{self.object_size}</Size>'
+            '</Version>'
+            for idx in range(self.objects))
+        return self._response(request, 200, (
+            f'<ListVersionsResult><Name>{_BUCKET}</Name>'
+            f'<IsTruncated>false</IsTruncated>{versions}'
+            '</ListVersionsResult>').encode())
+
+    def _s3_DeleteObjects(self, request):
+        return self._response(request, 200, b'<DeleteResult></DeleteResult>')
+
+    # DynamoDB
+    def _dynamodb_BatchWriteItem(self, request):
+        return self._json(request, {'UnprocessedItems': {}})
+
+    def _dynamodb_items(self):
+        items = [{
+            'category': {'S': 'dress'},
+            'sku': {'S': f'foo-apparel-{idx}'},
+            'product_name': {'S': f'Apparel{idx}'},
+            'is_published': {'BOOL': True},
+            'price': {'N': '34.75'},
+            'in_stock': {'BOOL': bool(idx % 2)}
+        } for idx in range(self.items)]
+        return {'Items': items, 'Count': len(items),
+            'ScannedCount': len(items)}
+
+    def _dynamodb_Query(self, request):
+        return self._json(request, self._dynamodb_items())
+
+    def _dynamodb_Scan(self, request):
+        return self._json(request, self._dynamodb_items())
+
+    # SNS
+    def _sns_PublishBatch(self, request):
+        body = request.body
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        params = parse_qs(body or '')
+        ids = [
+            value[0] for name, value in params.items()
+            if name.startswith('PublishBatchRequestEntries.member.')
+            and name.endswith('.Id')
+        ]
+        members = ''.join(
+            f'<member><Id>{entry_id}</Id>'
+            f'<MessageId>standin-{entry_id}</MessageId></member>'
+            for entry_id in ids)
+        return self._response(request, 200, (
+            '<PublishBatchResponse><PublishBatchResult>'
+            f'<Successful>{members}</Successful><Failed/>'
+            '</PublishBatchResult><ResponseMetadata>'
+            '<RequestId>standin</RequestId></ResponseMetadata>'
+            '</PublishBatchResponse>').encode())
+
+    def _sns_Publish(self, request):
+        return self._response(request, 200, (
+            '<PublishResponse><PublishResult>'
+            '<MessageId>standin</MessageId></PublishResult>'
+            '</PublishResponse>').encode())
+
+    # CloudWatch Logs
+    def _cloudwatch_logs_FilterLogEvents(self, request):
+        params = json.loads(request.body or b'{}')
+        start = params.get('startTime', _LOG_START)
+        stop = params.get('endTime', _LOG_STOP)
+        # log_events events spread evenly over the benchmark time range,
+        # of which those in the inclusive requested range are returned
+        step = (_LOG_STOP - _LOG_START) // max(self.log_events, 1)
+        first = max(0, -(-(start - _LOG_START) // step))
+        last = min(self.log_events, (stop - _LOG_START) // step + 1)
+        page = int(params.get('nextToken', 0))
+        begin = first + page * self.events_per_page
+        end = min(begin + self.events_per_page, last)
+        events = [{
+            'logStreamName': 'stream',
+            'timestamp': _LOG_START + idx * step,
+            'message': f'ERROR benchmark event {idx}',
+            'ingestionTime': _LOG_START + idx * step,
+            'eventId': f'{idx}'
+        } for idx in range(begin, end)]
+        data = {'events': events, 'searchedLogStreams': []}
+        if end < last:
+            data['nextToken'] = f'{page + 1}'
+        return self._json(request, data)
+
+
+def _run_concurrently(func, args_list, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda args: func(*args), args_list))
+
+
+def _create_resources(objects):
+    """Create the benchmark resources on a real endpoint (e.g. moto)"""
+    from botocore.exceptions import ClientError
+
+    import dynamo_manager
+    import s3_manager
+
+    s3 = get_client('s3')
+    try:
+        s3.create_bucket(Bucket=_BUCKET)
+    except ClientError:
+        pass
+    try:
+        dynamo_manager.create_dynamo_table(_TABLE,
+            [{'AttributeName': 'category', 'KeyType': 'HASH'},
+             {'AttributeName': 'sku', 'KeyType': 'RANGE'}],
+            [{'AttributeName': 'category', 'AttributeType': 'S'},
+             {'AttributeName': 'sku', 'AttributeType': 'S'}])
+    except ClientError:
+        pass
+    dynamo_manager.create_dynamo_items(_TABLE, objects)
+    topic_arn = get_client('sns').create_topic(Name=_TOPIC)['TopicArn']
+    logs = get_client('logs')
+    try:
+        logs.create_log_group(logGroupName=_LOG_GROUP)
+        logs.create_log_stream(logGroupName=_LOG_GROUP, logStreamName='stream')
+    except ClientError:
+        pass
+    step = (_LOG_STOP - _LOG_START) // objects
+    logs.put_log_events(logGroupName=_LOG_GROUP, logStreamName='stream',
+        logEvents=[{
+            'timestamp': _LOG_START + idx * step,
+            'message': f'ERROR benchmark event {idx}'
+        } for idx in range(objects)])
+    s3_manager.enable_bucket_versioning(_BUCKET)
+    return topic_arn
+
+
+def _benchmarks(workdir, count, concurrency, objects, items, messages,
+        topic_arn):
+    """Return the benchmarks as name -> (setup, run), where run returns
+    the number of operations done"""
+    import cwlogs_manager
+    import dynamo_manager
+    import s3_manager
+    import sns_manager
+
+    # s3_manager uses the path as object key, so keys stay short and
+    # relative to the working directory
+    files = []
+    for idx in range(count):
+        path = f'object-{idx}.txt'
+        with open(os.path.join(workdir, path), 'w') as fh:
+            fh.write('0' * 1024)
+        files.append(path)
+    downloads = os.path.join(workdir, 'downloads')
+    os.makedirs(downloads, exist_ok=True)
+
+    def upload(paths):
+        _run_concurrently(s3_manager.create_bucket_object,
+            [(_BUCKET, path) for path in paths], concurrency)
+        return len(paths)
+
+    def download():
+        _run_concurrently(s3_manager.get_bucket_object,
+            [(_BUCKET, path, downloads) for path in files], concurrency)
+        return len(files)
+
+    def query():
+        _run_concurrently(dynamo_manager.query_products,
+            [(_TABLE, 'dress')] * count, concurrency)
+        return count
+
+    def scan():
+        _run_concurrently(dynamo_manager.scan_products,
+            [(_TABLE, 'is_published', 'eq', True)] * count, concurrency)
+        return count
+
+    def publish():
+        result = sns_manager.publish_sns_batch(topic_arn,
+            (f'benchmark message {idx}' for idx in range(messages)),
+            max_in_flight=concurrency)
+        return result['sent']
+
+    def filter_events():
+        return len(cwlogs_manager.filter_log_events(_LOG_GROUP, 'ERROR',
+            start=_LOG_START, stop=_LOG_STOP))
+
+    def filter_events_parallel():
+        return sum(1 for _ in cwlogs_manager.iter_log_events_parallel(
+            [_LOG_GROUP], 'ERROR', _LOG_START, _LOG_STOP,
+            windows=concurrency, max_workers=concurrency))
+
+    return {
+        's3_upload': (None, lambda: upload(files)),
+        's3_download': (lambda: upload(files), download),
+        's3_delete': (lambda: upload(files[:objects]),
+            lambda: s3_manager.delete_bucket_objects(_BUCKET)),
+        'dynamodb_batch_write': (None,
+            lambda: dynamo_manager.create_dynamo_items(_TABLE, items)
+                and items),
+        'dynamodb_query': (None, query),
+        'dynamodb_scan': (None, scan),
+        'sns_publish': (None, publish),
+        'logs_filter': (None, filter_events),
+        'logs_filter_parallel': (None, filter_events_parallel),
+    }
+
+
+def run_benchmarks(names=None, repeat=3, count=200, concurrency=8,
+        objects=500, items=500, messages=1000, log_events=1000,
+        latency=0.005, jitter=0.0, throttle_rate=0.0, endpoint_url=None,
+        seed=0):
+    """Benchmark the managers' S3, DynamoDB, SNS and log filtering paths
+
+    Without endpoint_url, AWS is replaced by a StandIn; with it, requests
+    go to that endpoint (e.g. a local moto server) after the injected
+    latency and throttling.
+
+    :params names: Benchmarks to run (default: all)
+    :params type: list
+
+    :params latency: Injected latency per request, in seconds
+    :params type: float
+
+    :params throttle_rate: Share of requests answered with a throttling
+    error, which botocore retries
+    :params type: float
+
+    :returns: Settings, environment and per-benchmark results with
+    seconds, operations per second, requests and throttles.
+    :rtype: dict
+    """
+    # Credentials are only needed to sign requests, which never reach AWS
+    for name, value in (('AWS_ACCESS_KEY_ID', 'benchmark'),
+            ('AWS_SECRET_ACCESS_KEY', 'benchmark'),
+            ('AWS_DEFAULT_REGION', _REGION),
+            ('AWS_EC2_METADATA_DISABLED', 'true')):
+        os.environ.setdefault(name, value)
+
+    settings = {
+        'repeat': repeat,
+        'count': count,
+        'concurrency': concurrency,
+        'objects': objects,
+        'items': items,
+        'messages': messages,
+        'log_events': log_events,
+        'latency': latency,
+        'jitter': jitter,
+        'throttle_rate': throttle_rate,
+        'endpoint_url': endpoint_url,
+    }
+    standin = StandIn(latency, jitter, throttle_rate,
+        objects=objects, items=min(items, 100), log_events=log_events,
+        passthrough=bool(endpoint_url), seed=seed)
+    if endpoint_url:
+        set_endpoint_url(endpoint_url)
+        topic_arn = _create_resources(objects)
+    else:
+        topic_arn = _TOPIC_ARN
+    add_client_hook(standin.install)
+
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            benchmarks = _benchmarks(workdir, count, concurrency, objects,
+                items, messages, topic_arn)
+            for name, (setup, run) in benchmarks.items():
+                if names and name not in names:
+                    continue
+                timings = []
+                for _ in range(repeat):
+                    if setup:
+                        setup()
+                    requests, throttles = standin.counts()
+                    start = time.perf_counter()
+                    ops = run()
+                    timings.append(time.perf_counter() - start)
+                    after = standin.counts()
+                    requests = after[0] - requests
+                    throttles = after[1] - throttles
+                median = statistics.median(timings)
+                results[name] = {
+                    'ops': ops,
+                    'min_seconds': round(min(timings), 4),
+                    'median_seconds': round(median, 4),
+                    'ops_per_sec': round(ops / median, 1) if median else 0.0,
+                    'requests': requests,
+                    'throttles': throttles
+                }
+        finally:
+            os.chdir(cwd)
+
+    import boto3
+    return {
+        'settings': settings,
+        'environment': {
+            'python': platform.python_version(),
+            'boto3': boto3.__version__,
+            'platform': platform.platform(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        },
+        'results': results
+    }
+
+
+def compare_results(report, baseline, tolerance=0.2):
+    """Return the benchmarks whose throughput dropped more than tolerance
+    below the baseline
+
+    :returns: One entry per regression with baseline and current
+    operations per second.
+    :rtype: list
+    """
+    regressions = []
+    for name, result in report['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base or not base.get('ops_per_sec'):
+            continue
+        change = result['ops_per_sec'] / base['ops_per_sec'] - 1
+        if change < -tolerance:
+            regressions.append({
+                'benchmark': name,
+                'baseline_ops_per_sec': base['ops_per_sec'],
+                'ops_per_sec': result['ops_per_sec'],
+                'change': round(change, 3)
+            })
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark S3, DynamoDB, SNS and CloudWatch Logs\
+        operations offline, against a local stand-in with injected latency\
+        and throttling'
+    )
+
+    parser.add_argument(
+        '--only',
+        help='Benchmark to run (may be repeated; default: all)',
+        action='append'
+    )
+
+    parser.add_argument(
+        '--repeat',
+        help='Number of runs per benchmark (default: 3)',
+        type=int,
+        default=3
+    )
+
+    parser.add_argument(
+        '--count',
+        help='Number of uploads, downloads, queries and scans (default: 200)',
+        type=int,
+        default=200
+    )
+
+    parser.add_argument(
+        '--concurrency',
+        help='Number of concurrent calls, in-flight batches and log\
+        windows (default: 8)',
+        type=int,
+        default=8
+    )
+
+    parser.add_argument(
+        '--objects',
+        help='Number of object versions to delete (default: 500)',
+        type=int,
+        default=500
+    )
+
+    parser.add_argument(
+        '--items',
+        help='Number of DynamoDB items to batch write (default: 500)',
+        type=int,
+        default=500
+    )
+
+    parser.add_argument(
+        '--messages',
+        help='Number of SNS messages to publish (default: 1000)',
+        type=int,
+        default=1000
+    )
+
+    parser.add_argument(
+        '--log_events',
+        help='Number of log events to filter (default: 1000)',
+        type=int,
+        default=1000
+    )
+
+    parser.add_argument(
+        '--latency',
+        help='Injected latency per request in milliseconds (default: 5)',
+        type=float,
+        default=5.0
+    )
+
+    parser.add_argument(
+        '--jitter',
+        help='Maximum random latency added per request in milliseconds\
+        (default: 0)',
+        type=float,
+        default=0.0
+    )
+
+    parser.add_argument(
+        '--throttle_rate',
+        help='Share of requests throttled, between 0 and 1 (default: 0)',
+        type=float,
+        default=0.0
+    )
+
+    parser.add_argument(
+        '--endpoint_url',
+        help='Send requests to this endpoint, e.g. a local moto server,\
+        instead of the built-in stand-in'
+    )
+
+    parser.add_argument(
+        '--save',
+        help='Write the results as a JSON baseline to this file'
+    )
+
+    parser.add_argument(
+        '--compare',
+        help='Baseline JSON file to compare the results against;\
+        exits with status 1 on regressions'
+    )
+
+    parser.add_argument(
+        '--tolerance',
+        help='Allowed throughput drop against the baseline (default: 0.2)',
+        type=float,
+        default=0.2
+    )
+
+    parser.add_argument(
+        '--json',
+        help='Print results as JSON',
+        action='store_true',
+        default=False
+    )
+
+    args = parser.parse_args()
+    report = run_benchmarks(
+        args.only, args.repeat, args.count, args.concurrency,
+        args.objects, args.items, args.messages, args.log_events,
+        args.latency / 1000, args.jitter / 1000, args.throttle_rate,
+        args.endpoint_url
+    )
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f'{"benchmark":<22} {"ops":>6} {"median s":>9} {"ops/s":>9}'
+              f' {"requests":>8} {"throttles":>9}')
+        for name, r in report['results'].items():
+            print(f'{name:<22} {r["ops"]:>6} {r["median_seconds"]:>9}'
+                  f' {r["ops_per_sec"]:>9} {r["requests"]:>8}'
+                  f' {r["throttles"]:>9}')
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        regressions = compare_results(report, baseline, args.tolerance)
+        for r in regressions:
+            print(f'Regression in {r["benchmark"]}: '
+                  f'{r["baseline_ops_per_sec"]} -> {r["ops_per_sec"]} ops/s '
+                  f'({r["change"]:+.0%})', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
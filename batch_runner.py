@@ -0,0 +1,271 @@
+import importlib
+import io
+import json
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from client_manager import get_client
+
+# Manifest service name -> (manager module, boto3 service name)
+SERVICES = {
+    's3': ('s3_manager', 's3'),
+    'dynamodb': ('dynamo_manager', 'dynamodb'),
+    'sns': ('sns_manager', 'sns'),
+    'logs': ('cwlogs_manager', 'logs'),
+}
+
+_stdout_lock = threading.Lock()
+
+
+def load_manifest(manifest_file):
+    """Load operations from an NDJSON or YAML manifest
+
+    Each operation is a mapping with an optional 'id' (default: its
+    position), 'service' (s3, dynamodb, sns or logs), 'op' (the manager
+    function name), optional 'args' and 'kwargs', and an optional
+    'depends_on' list of operation ids that must succeed first.
+    """
+    with open(manifest_file) as fh:
+        content = fh.read()
+    if manifest_file.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError('PyYAML is required for YAML manifests.')
+        operations = yaml.safe_load(content) or []
+    else:
+        operations = [
+            json.loads(line) for line in content.splitlines()
+            if line.strip()
+        ]
+    for idx, operation in enumerate(operations):
+        operation.setdefault('id', str(idx))
+    return operations
+
+
+def validate_manifest(operations):
+    """Check services, functions and dependencies of the operations"""
+    ids = [operation['id'] for operation in operations]
+    if len(set(ids)) != len(ids):
+        raise ValueError('Duplicate operation ids in manifest.')
+    for operation in operations:
+        if operation.get('service') not in SERVICES:
+            raise ValueError(
+                f'Operation {operation["id"]}: unknown service '
+                f'{operation.get("service")}')
+        if str(operation.get('op', '_')).startswith('_'):
+            raise ValueError(
+                f'Operation {operation["id"]}: invalid op '
+                f'{operation.get("op")}')
+        for dep in operation.get('depends_on', []):
+            if dep not in ids:
+                raise ValueError(
+                    f'Operation {operation["id"]}: unknown dependency {dep}')
+    # Kahn's algorithm; anything left over is part of a cycle
+    pending = {op['id']: set(op.get('depends_on', [])) for op in operations}
+    while pending:
+        ready = [op_id for op_id, deps in pending.items() if not deps]
+        if not ready:
+            raise ValueError(f'Dependency cycle between {sorted(pending)}')
+        for op_id in ready:
+            del pending[op_id]
+        for deps in pending.values():
+            deps.difference_update(ready)
+
+
+def resolve_operation(operation):
+    """Return the manager function an operation refers to"""
+    module_name, _ = SERVICES[operation['service']]
+    module = importlib.import_module(module_name)
+    func = getattr(module, operation['op'], None)
+    if not isinstance(func, types.FunctionType):
+        raise ValueError(
+            f'Operation {operation["id"]}: {module_name} has no function '
+            f'{operation["op"]}')
+    return func
+
+
+def warm_clients(operations):
+    """Create the clients used by the operations before running them"""
+    for service in {operation['service'] for operation in operations}:
+        get_client(SERVICES[service][1])
+
+
+class _ThreadStdout(io.TextIOBase):
+    """sys.stdout replacement capturing writes of operation threads"""
+
+    def __init__(self, stdout):
+        self._stdout = stdout
+        self._local = threading.local()
+
+    def capture(self):
+        self._local.buffer = io.StringIO()
+
+    def release(self):
+        buffer = self._local.__dict__.pop('buffer', None)
+        return buffer.getvalue() if buffer else ''
+
+    def write(self, text):
+        buffer = getattr(self._local, 'buffer', None)
+        return (buffer or self._stdout).write(text)
+
+    def flush(self):
+        self._stdout.flush()
+
+
+def _thread_stdout():
+    """Return the installed _ThreadStdout, replacing sys.stdout once"""
+    with _stdout_lock:
+        if not isinstance(sys.stdout, _ThreadStdout):
+            sys.stdout = _ThreadStdout(sys.stdout)
+        return sys.stdout
+
+
+def run_operation(operation, stream=None):
+    """Run one operation and return its result record
+
+    Whatever the operation prints (e.g. the manager functions printing
+    API responses) is captured in the record's 'stdout' instead of being
+    interleaved with the records of concurrent operations.
+
+    Generators returned by iter_* functions are consumed into the result,
+    unless `stream` is given: it is called with the generator instead and
+    returns the number of items it consumed, which becomes the result.
+    """
+    record = {
+        'id': operation['id'],
+        'service': operation['service'],
+        'op': operation['op'],
+    }
+    stdout = _thread_stdout()
+    stdout.capture()
+    start = time.perf_counter()
+    try:
+        func = resolve_operation(operation)
+        result = func(*operation.get('args', []),
+            **operation.get('kwargs', {}))
+        # Generators (iter_* functions) are consumed so their calls are timed
+        if isinstance(result, types.GeneratorType):
+            result = list(result) if stream is None else stream(result)
+        record.update(status='ok', result=result)
+    except Exception as err:
+        record.update(status='failed', error=f'{type(err).__name__}: {err}')
+    finally:
+        output = stdout.release()
+    if output:
+        record['stdout'] = output
+    record['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return record
+
+
+def run_manifest(operations, max_workers=8):
+    """Run operations concurrently, respecting their dependencies
+
+    An operation starts once every operation it depends on succeeded;
+    dependents of failed or skipped operations are skipped.
+
+    :returns: Generator of result records in completion order.
+    :rtype: generator
+    """
+    validate_manifest(operations)
+    by_id = {operation['id']: operation for operation in operations}
+    waiting = {
+        operation['id']: set(operation.get('depends_on', []))
+        for operation in operations
+    }
+    dependents = {op_id: [] for op_id in by_id}
+    for op_id, deps in waiting.items():
+        for dep in deps:
+            dependents[dep].append(op_id)
+
+    def skip(op_id, reason):
+        """Skip an operation and, transitively, its dependents"""
+        skipped = []
+        stack = [(op_id, reason)]
+        while stack:
+            op_id, reason = stack.pop()
+            if waiting.pop(op_id, None) is None:
+                continue
+            operation = by_id[op_id]
+            skipped.append({
+                'id': op_id,
+                'service': operation['service'],
+                'op': operation['op'],
+                'status': 'skipped',
+                'error': reason,
+                'elapsed_ms': 0.0
+            })
+            stack.extend(
+                (dep_id, f'dependency {op_id} skipped')
+                for dep_id in dependents[op_id])
+        return skipped
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+
+        def submit_ready():
+            for op_id in [i for i, deps in waiting.items() if not deps]:
+                del waiting[op_id]
+                future = executor.submit(run_operation, by_id[op_id])
+                running[future] = op_id
+
+        submit_ready()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                op_id = running.pop(future)
+                record = future.result()
+                yield record
+                for dep_id in dependents[op_id]:
+                    if dep_id not in waiting:
+                        continue
+                    if record['status'] == 'ok':
+                        waiting[dep_id].discard(op_id)
+                    else:
+                        yield from skip(dep_id, f'dependency {op_id} failed')
+            submit_ready()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Run a manifest of S3, DynamoDB, SNS and CloudWatch Logs\
+        operations in one process'
+    )
+
+    parser.add_argument(
+        'manifest',
+        help='Manifest file (.ndjson/.jsonl, or .yaml/.yml)'
+    )
+
+    parser.add_argument(
+        '--max_workers',
+        help='Maximum number of operations running at once (default: 8)',
+        type=int,
+        default=8
+    )
+
+    args = parser.parse_args()
+    operations = load_manifest(args.manifest)
+    try:
+        validate_manifest(operations)
+    except ValueError as err:
+        print(f'Invalid manifest: {err}', file=sys.stderr)
+        sys.exit(1)
+    warm_clients(operations)
+
+    from output_manager import json_default
+
+    counts = {}
+    start = time.perf_counter()
+    for record in run_manifest(operations, args.max_workers):
+        counts[record['status']] = counts.get(record['status'], 0) + 1
+        print(json.dumps(record, default=json_default), flush=True)
+    elapsed = time.perf_counter() - start
+    print(f'{counts} in {elapsed:.2f}s', file=sys.stderr)
+    if counts.get('failed') or counts.get('skipped'):
+        sys.exit(1)
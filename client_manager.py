@@ -0,0 +1,141 @@
+import os
+import threading
+
+# Shared by every manager so concurrent workloads reuse sessions, clients
+# and their HTTP connection pools instead of repeating TLS handshakes.
+# boto3 is imported on first use so CLI startup (--help, argument errors)
+# does not pay for loading botocore.
+_lock = threading.Lock()
+_local = threading.local()
+_sessions = {}
+_clients = {}
+_generation = 0
+_client_hooks = []
+# Endpoint URL per service name, with None as the fallback for all
+_endpoint_urls = {}
+if os.environ.get('BOTO3_MANAGER_ENDPOINT_URL'):
+    _endpoint_urls[None] = os.environ['BOTO3_MANAGER_ENDPOINT_URL']
+_client_config = {
+    'max_pool_connections': int(
+        os.environ.get('BOTO3_MANAGER_MAX_POOL_CONNECTIONS', 50)),
+    'tcp_keepalive': True
+}
+
+
+def configure_clients(**config):
+    """Set botocore Config options (e.g. max_pool_connections,
+    tcp_keepalive, connect_timeout, retries) for clients created from now
+    on. Cached clients are dropped so the new options take effect.
+    Without a retries option, each service's retry policy sets it.
+    """
+    global _generation
+    with _lock:
+        _client_config.update(config)
+        _clients.clear()
+        _generation += 1
+
+
+def set_endpoint_url(endpoint_url, service_name=None):
+    """Send requests for a service (default: all services) to another
+    endpoint, e.g. a local moto server. Cached clients are dropped.
+    """
+    global _generation
+    with _lock:
+        _endpoint_urls[service_name] = endpoint_url
+        _clients.clear()
+        _generation += 1
+
+
+def add_client_hook(hook):
+    """Call hook(client) for every client, existing and future, e.g. to
+    register botocore event handlers.
+    """
+    with _lock:
+        _client_hooks.append(hook)
+        clients = list(_clients.values())
+    for client in clients:
+        hook(client)
+
+
+def _config(service_name):
+    """Return the botocore Config of a service's clients"""
+    from botocore.config import Config
+
+    from retry_manager import get_policy
+
+    config = dict(_client_config)
+    config.setdefault('retries', get_policy(service_name).client_retries())
+    return Config(**config)
+
+
+def get_session(profile_name=None):
+    """Return the shared boto3 session for a profile"""
+    import boto3.session
+
+    with _lock:
+        session = _sessions.get(profile_name)
+        if session is None:
+            session = boto3.session.Session(profile_name=profile_name)
+            _sessions[profile_name] = session
+        return session
+
+
+def get_client(service_name, region_name=None, profile_name=None):
+    """Return the shared client for a service, region and profile
+
+    Clients are thread-safe and are created once per key.
+    """
+    key = (service_name, region_name, profile_name)
+    client = _clients.get(key)
+    if client is None:
+        session = get_session(profile_name)
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                # Session.client() is not thread-safe, hence the lock
+                client = session.client(
+                    service_name,
+                    region_name=region_name,
+                    endpoint_url=_endpoint_urls.get(
+                        service_name, _endpoint_urls.get(None)),
+                    config=_config(service_name)
+                )
+                for hook in _client_hooks:
+                    hook(client)
+                _clients[key] = client
+    return client
+
+
+def get_resource(service_name, region_name=None, profile_name=None):
+    """Return a resource for a service, region and profile
+
+    Resources are not thread-safe, so one is kept per thread, but all of
+    them share the pooled client from get_client().
+
+    Resource instances register boto3's customizations on their client
+    when created: for DynamoDB, each Table registers the handlers that
+    (de)serialize Python types and build condition expressions on the
+    shared client, which dynamo_manager relies on when calling
+    table.meta.client directly (e.g. batch_write_item).
+    """
+    key = (service_name, region_name, profile_name)
+    if getattr(_local, 'generation', None) != _generation:
+        _local.generation = _generation
+        _local.resources = {}
+    resources = _local.resources
+    resource = resources.get(key)
+    if resource is None:
+        session = get_session(profile_name)
+        with _lock:
+            # Session.resource() is not thread-safe, hence the lock
+            resource = session.resource(
+                service_name,
+                region_name=region_name,
+                endpoint_url=_endpoint_urls.get(
+                    service_name, _endpoint_urls.get(None)),
+                config=_config(service_name)
+            )
+        resource.meta.client = get_client(
+            service_name, region_name, profile_name)
+        resources[key] = resource
+    return resource
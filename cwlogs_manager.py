@@ -1,55 +1,1112 @@
-import boto3
 import sys
-from datetime import datetime, timezone
+import os
+import re
+import time
+import heapq
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
 import json
+import logging
+import socket
 
-def list_log_groups(group_name=None, region_name=None):
-    cwlogs = boto3.client('logs', region_name=region_name)
+from client_manager import get_client
+
+log = logging.getLogger(__name__)
+
+_RELATIVE_TIME = re.compile(
+    r'^-?(?P<value>\d+)\s*(?P<unit>[smhdw])(?:\s+ago)?$', re.IGNORECASE)
+_TIME_UNITS = {
+    's': 'seconds',
+    'm': 'minutes',
+    'h': 'hours',
+    'd': 'days',
+    'w': 'weeks'
+}
+
+# Sentinel marking the end of a fetched time window
+_WINDOW_DONE = object()
+
+# Late-arriving events older than the checkpoint by this much are still
+# picked up when tailing
+_TAIL_LOOKBACK_MS = 5000
+
+# Logs Insights allows 30 concurrent queries per account; leave headroom
+# for other users of the account
+_INSIGHTS_MAX_CONCURRENT = 10
+_INSIGHTS_DONE = ('Complete', 'Failed', 'Cancelled', 'Timeout', 'Unknown')
+
+# PutLogEvents limits: 1 MiB per batch counting 26 bytes of overhead per
+# event, 10,000 events, and at most 24 hours between the first and last
+_PUT_BATCH_BYTES = 1024 * 1024
+_PUT_BATCH_COUNT = 10000
+_PUT_EVENT_OVERHEAD = 26
+_PUT_EVENT_BYTES = 256 * 1024 - _PUT_EVENT_OVERHEAD
+_PUT_BATCH_SPAN_MS = 24 * 60 * 60 * 1000
+
+# Events younger than this may still be ingested, so their time buckets
+# are never marked as cached
+_CACHE_SETTLE_MS = 5 * 60 * 1000
+
+
+def parse_time(value, now=None):
+    """Convert a time specification to milliseconds since the epoch.
+
+    Accepts epoch milliseconds, ISO 8601 timestamps (naive ones are taken
+    as UTC), 'now' and relative times such as '15m', '2h ago' or '-1d'.
+    """
+    if value is None or isinstance(value, int):
+        return value
+    value = value.strip()
+    now = now or datetime.now(timezone.utc)
+    if value.isdigit():
+        return int(value)
+    if value.lower() == 'now':
+        return int(now.timestamp() * 1000)
+    match = _RELATIVE_TIME.match(value)
+    if match:
+        delta = timedelta(**{
+            _TIME_UNITS[match['unit'].lower()]: int(match['value'])
+        })
+        return int((now - delta).timestamp() * 1000)
+    try:
+        dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f'Invalid time: {value}')
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+def iter_log_groups(group_name=None, region_name=None, cwlogs=None):
+    """Yield all log groups, following nextToken across pages"""
+    cwlogs = cwlogs or get_client('logs', region_name)
     params = {
         'logGroupNamePrefix': group_name
     } if group_name else {}
-    res = cwlogs.describe_log_groups(**params)
-    return res['logGroups']
+    paginator = cwlogs.get_paginator('describe_log_groups')
+    for page in paginator.paginate(**params):
+        yield from page['logGroups']
+
+
+def list_log_groups(group_name=None, region_name=None):
+    return list(iter_log_groups(group_name, region_name))
 #    print(res['logGroups'])
-    
-    
-def list_log_group_streams(group_name=None, stream_name=None, region_name=None):
-    cwlogs = boto3.client('logs', region_name=region_name)
+
+
+def iter_log_group_streams(group_name=None, stream_name=None,
+        region_name=None, order_by_last_event=False, cwlogs=None):
+    """Yield all log streams of a log group, following nextToken
+
+    With order_by_last_event, streams are returned most recently written
+    first. CloudWatch Logs cannot combine this with a stream name prefix.
+    """
+    if stream_name and order_by_last_event:
+        raise ValueError('Log streams ordered by last event cannot be'
+            ' filtered by stream name.')
+    cwlogs = cwlogs or get_client('logs', region_name)
     params = {
         'logGroupName': group_name
     } if group_name else {}
     if stream_name:
         params['logStreamNamePrefix'] = stream_name
-    res = cwlogs.describe_log_streams(**params)
-    return res['logStreams']
-#    print(res['logStreams'])
-  
+    if order_by_last_event:
+        params['orderBy'] = 'LastEventTime'
+        params['descending'] = True
+    paginator = cwlogs.get_paginator('describe_log_streams')
+    for page in paginator.paginate(**params):
+        yield from page['logStreams']
     
-def filter_log_events(
-        group_name, filter_pat,
-        region_name=None,
-        start=None, stop=None):
     
-    cwlogs = boto3.client('logs', region_name=region_name)
+def list_log_group_streams(group_name=None, stream_name=None, region_name=None):
+    return list(iter_log_group_streams(group_name, stream_name, region_name))
+#    print(res['logStreams'])
+
+
+def _last_event_timestamp(cwlogs, group_name):
+    """Return the last event time of a log group from its newest stream"""
+    res = cwlogs.describe_log_streams(
+        logGroupName=group_name,
+        orderBy='LastEventTime',
+        descending=True,
+        limit=1
+    )
+    streams = res['logStreams']
+    return streams[0].get('lastEventTimestamp', 0) if streams else 0
+
+
+def _list_region_groups(cwlogs, region_name, group_name, with_last_event):
+    for group in iter_log_groups(group_name, cwlogs=cwlogs):
+        group['region'] = region_name
+        if with_last_event:
+            group['lastEventTimestamp'] = _last_event_timestamp(
+                cwlogs, group['logGroupName'])
+        yield group
+
+
+def iter_log_groups_multi_region(
+        region_names, group_name=None,
+        with_last_event=False, max_workers=None):
+    """List log groups of several regions concurrently
+
+    Groups are yielded as soon as any region returns them, tagged with
+    their 'region'. One client is shared by all requests to a region.
+
+    :params region_names: Names of regions where to list log groups
+    :params type: list
+
+    :params with_last_event: Also look up each group's last event time
+    (as 'lastEventTimestamp') from its most recently written stream
+    :params type: bool
+    """
+    clients = {
+        region_name: get_client('logs', region_name)
+        for region_name in region_names
+    }
+    out = queue.Queue(maxsize=1000)
+    cancel = threading.Event()
+    executor = ThreadPoolExecutor(
+        max_workers=max_workers or len(region_names))
+    try:
+        for region_name, cwlogs in clients.items():
+            executor.submit(_fetch_into, out, cancel,
+                _list_region_groups(cwlogs, region_name, group_name,
+                    with_last_event))
+        remaining = len(clients)
+        while remaining:
+            item = out.get()
+            if item is _WINDOW_DONE:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        cancel.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _iter_log_events(cwlogs, group_name, filter_pat,
+        start=None, stop=None, stream_prefix=None):
     params = {
         'logGroupName': group_name,
         'filterPattern': filter_pat
     }
     
-    if start:
+    if start is not None:
         params['startTime'] = start
-    if stop:
+    if stop is not None:
         params['endTime'] = stop
-    res = cwlogs.filter_log_events(**params)
-    return res['events']
+    if stream_prefix:
+        params['logStreamNamePrefix'] = stream_prefix
+    paginator = cwlogs.get_paginator('filter_log_events')
+    for page in paginator.paginate(**params):
+        yield from page['events']
+
+
+def iter_log_events(
+        group_name, filter_pat,
+        region_name=None,
+        start=None, stop=None, stream_prefix=None):
+    """Yield matching log events, following nextToken across pages"""
+    cwlogs = get_client('logs', region_name)
+    yield from _iter_log_events(cwlogs, group_name, filter_pat,
+        parse_time(start), parse_time(stop), stream_prefix)
+
+
+def filter_log_events(
+        group_name, filter_pat,
+        region_name=None,
+        start=None, stop=None, cache=None):
+    if cache is not None:
+        return list(cache.iter_log_events(group_name, filter_pat,
+            region_name, start, stop))
+    return list(iter_log_events(group_name, filter_pat,
+        region_name, start, stop))
 #    print(res['events'])
 
+
+def split_time_range(start, stop, windows):
+    """Split the inclusive range [start, stop] into at most `windows`
+    contiguous, non-overlapping (start, stop) windows.
+    """
+    if start is None or start > stop:
+        raise ValueError('A start time before the end time is required.')
+    step = max(-(-(stop - start + 1) // windows), 1)
+    bounds = []
+    w_start = start
+    while w_start <= stop:
+        # Window end times are inclusive, so windows must not overlap
+        w_stop = min(w_start + step - 1, stop)
+        bounds.append((w_start, w_stop))
+        w_start = w_stop + 1
+    return bounds
+
+
+def _fetch_into(out, cancel, items):
+    """Push items into a bounded queue, followed by _WINDOW_DONE"""
+    def put(item):
+        while not cancel.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        for item in items:
+            if not put(item):
+                return
+    except Exception as err:
+        put(err)
+    put(_WINDOW_DONE)
+
+
+def _fetch_window(cwlogs, out, cancel, group_name, filter_pat,
+        start, stop, stream_prefix):
+    """Push the events of one group/window into a bounded queue"""
+    events = _iter_log_events(cwlogs, group_name, filter_pat,
+        start, stop, stream_prefix)
+    _fetch_into(out, cancel, (
+        dict(event, logGroupName=group_name) for event in events
+    ))
+
+
+def _drain(out):
+    while True:
+        item = out.get()
+        if item is _WINDOW_DONE:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def iter_log_events_parallel(
+        group_names, filter_pat,
+        start, stop=None,
+        region_name=None, stream_prefixes=None,
+        windows=8, max_workers=8, queue_size=1000):
+    """Fetch log events concurrently and yield them in timestamp order
+
+    The [start, stop] range is split into `windows` time windows that are
+    fetched concurrently for every log group and stream prefix. Each fetch
+    buffers at most `queue_size` events, and windows are merged in order,
+    so memory stays bounded regardless of the range size.
+
+    :params group_names: Names of log groups to search
+    :params type: list
+
+    :params start: Start time (epoch ms, ISO 8601 or relative time)
+    :params type: str
+
+    :params stop: End time (default: now)
+    :params type: str
+
+    :params stream_prefixes: Optional log stream name prefixes
+    :params type: list
+
+    :params max_workers: Maximum number of concurrent fetches, raised to
+    the number of groups times stream prefixes if lower
+    :params type: int
+    """
+    bounds = split_time_range(parse_time(start), parse_time(stop or 'now'),
+        windows)
+    
+    cwlogs = get_client('logs', region_name)
+    cancel = threading.Event()
+    # Every queue of the window being merged needs a running fetch, or
+    # the merge waits on a queue whose fetch is stuck behind fetches
+    # blocked on full queues
+    per_window = len(group_names) * len(stream_prefixes or [None])
+    executor = ThreadPoolExecutor(max_workers=max(max_workers, per_window))
+    try:
+        # Tasks are submitted in window order and started first in, first
+        # out, so the windows being merged are always the ones being fetched
+        queues = []
+        for w_start, w_stop in bounds:
+            window_queues = []
+            for group_name in group_names:
+                for prefix in stream_prefixes or [None]:
+                    out = queue.Queue(maxsize=queue_size)
+                    executor.submit(_fetch_window, cwlogs, out, cancel,
+                        group_name, filter_pat, w_start, w_stop, prefix)
+                    window_queues.append(out)
+            queues.append(window_queues)
+        for window_queues in queues:
+            yield from heapq.merge(
+                *[_drain(out) for out in window_queues],
+                key=lambda event: event['timestamp']
+            )
+    finally:
+        cancel.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+class LogCache:
+    """On-disk SQLite cache of log events, indexed by group and time.
+
+    Fetched events are stored per region, log group, filter pattern and
+    stream prefix in fixed time buckets of `bucket_ms`. Queries are served
+    from the cache for the buckets it covers and only the missing buckets
+    are fetched from the API. Buckets that are too recent to be complete
+    are never cached. Once the cached message bytes exceed `max_bytes`,
+    the least recently used buckets are evicted.
+
+    Usage::
+
+        cache = LogCache('logs.db')
+        events = filter_log_events(group, pattern, start='1d', cache=cache)
+        print(cache.stats())
+    """
+
+    # Bumped when the tables change; older caches are dropped
+    _SCHEMA_VERSION = 2
+
+    def __init__(self, path, bucket_ms=60 * 60 * 1000,
+            max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.bucket_ms = bucket_ms
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        import sqlite3
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        if version != self._SCHEMA_VERSION:
+            self._db.executescript(f'''
+                DROP TABLE IF EXISTS events;
+                DROP TABLE IF EXISTS buckets;
+                PRAGMA user_version = {self._SCHEMA_VERSION};
+            ''')
+        # Scope columns are '' rather than NULL, as NULLs never collide in
+        # primary keys
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS events (
+                region_name TEXT, group_name TEXT, filter_pat TEXT,
+                stream_prefix TEXT, bucket INTEGER,
+                event_id TEXT, timestamp INTEGER, ingestion_time INTEGER,
+                stream_name TEXT, message TEXT,
+                PRIMARY KEY (region_name, group_name, filter_pat,
+                    stream_prefix, event_id)
+            );
+            CREATE INDEX IF NOT EXISTS events_time
+                ON events (region_name, group_name, filter_pat,
+                    stream_prefix, timestamp);
+            CREATE TABLE IF NOT EXISTS buckets (
+                region_name TEXT, group_name TEXT, filter_pat TEXT,
+                stream_prefix TEXT, bucket INTEGER,
+                bytes INTEGER, accessed REAL,
+                PRIMARY KEY (region_name, group_name, filter_pat,
+                    stream_prefix, bucket)
+            );
+        ''')
+
+    def close(self):
+        self._db.close()
+
+    def stats(self):
+        """Return bucket hit/miss counts and the cache size"""
+        with self._lock:
+            n_buckets, n_bytes = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM buckets'
+            ).fetchone()
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 3) if total else 0.0,
+            'buckets': n_buckets,
+            'bytes': n_bytes
+        }
+
+    def iter_log_events(self, group_name, filter_pat,
+            region_name=None, start=None, stop=None, stream_prefix=None):
+        """Yield matching log events in timestamp order, using the cache
+        for every complete time bucket in [start, stop].
+
+        A start time is required, as every bucket from start on is looked
+        up and recorded.
+        """
+        start = parse_time(start)
+        if start is None:
+            raise ValueError('A start time is required for cached queries.')
+        stop = parse_time(stop or 'now')
+        cwlogs = get_client('logs', region_name)
+        # (region, group, pattern, prefix) the cached rows belong to
+        scope = (cwlogs.meta.region_name or '', group_name, filter_pat,
+            stream_prefix or '')
+        horizon = parse_time('now') - _CACHE_SETTLE_MS
+        # Last timestamp of the newest bucket that can be cached
+        cached_stop = min(
+            stop, (horizon // self.bucket_ms) * self.bucket_ms - 1)
+        if start <= cached_stop:
+            first = start // self.bucket_ms
+            last = cached_stop // self.bucket_ms
+            missing = self._missing_buckets(scope, first, last)
+            self.hits += (last - first + 1) - len(missing)
+            self.misses += len(missing)
+            for run_first, run_last in self._runs(missing):
+                self._fetch(cwlogs, scope, run_first, run_last)
+            self._touch(scope, first, last)
+            yield from self._select(scope, start, cached_stop)
+            self._evict()
+        if stop > cached_stop:
+            yield from _iter_log_events(cwlogs, group_name, filter_pat,
+                max(start, cached_stop + 1), stop, stream_prefix)
+
+    def _missing_buckets(self, scope, first, last):
+        with self._lock:
+            cached = {row[0] for row in self._db.execute(
+                '''SELECT bucket FROM buckets WHERE region_name = ?
+                AND group_name = ? AND filter_pat = ? AND stream_prefix = ?
+                AND bucket BETWEEN ? AND ?''',
+                (*scope, first, last))}
+        return [b for b in range(first, last + 1) if b not in cached]
+
+    @staticmethod
+    def _runs(buckets):
+        """Group sorted bucket numbers into contiguous (first, last) runs"""
+        runs = []
+        for bucket in buckets:
+            if runs and runs[-1][1] == bucket - 1:
+                runs[-1][1] = bucket
+            else:
+                runs.append([bucket, bucket])
+        return runs
+
+    def _fetch(self, cwlogs, scope, first, last):
+        """Fetch a run of buckets from the API and mark them cached"""
+        _, group_name, filter_pat, stream_prefix = scope
+        sizes = dict.fromkeys(range(first, last + 1), 0)
+        rows = []
+
+        def flush():
+            with self._lock, self._db:
+                self._db.executemany(
+                    '''INSERT OR IGNORE INTO events VALUES
+                    (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+            rows.clear()
+
+        for event in _iter_log_events(cwlogs, group_name, filter_pat,
+                first * self.bucket_ms, (last + 1) * self.bucket_ms - 1,
+                stream_prefix or None):
+            bucket = event['timestamp'] // self.bucket_ms
+            sizes[bucket] += len(event['message'])
+            rows.append((
+                *scope, bucket,
+                event['eventId'], event['timestamp'],
+                event.get('ingestionTime'), event.get('logStreamName'),
+                event['message']
+            ))
+            if len(rows) >= 1000:
+                flush()
+        flush()
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(*scope, bucket, size, now)
+                 for bucket, size in sizes.items()])
+
+    def _touch(self, scope, first, last):
+        with self._lock, self._db:
+            self._db.execute(
+                '''UPDATE buckets SET accessed = ? WHERE region_name = ?
+                AND group_name = ? AND filter_pat = ? AND stream_prefix = ?
+                AND bucket BETWEEN ? AND ?''',
+                (time.time(), *scope, first, last))
+
+    def _select(self, scope, start, stop):
+        with self._lock:
+            cursor = self._db.execute(
+                '''SELECT event_id, timestamp, ingestion_time, stream_name,
+                message FROM events WHERE region_name = ? AND group_name = ?
+                AND filter_pat = ? AND stream_prefix = ?
+                AND timestamp BETWEEN ? AND ? ORDER BY timestamp, event_id''',
+                (*scope, start, stop))
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(1000)
+            if not rows:
+                return
+            for event_id, timestamp, ingestion_time, stream, message in rows:
+                yield {
+                    'logStreamName': stream,
+                    'timestamp': timestamp,
+                    'message': message,
+                    'ingestionTime': ingestion_time,
+                    'eventId': event_id
+                }
+
+    def _evict(self):
+        """Drop least recently used buckets until under max_bytes"""
+        with self._lock, self._db:
+            total = self._db.execute(
+                'SELECT COALESCE(SUM(bytes), 0) FROM buckets').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            victims = []
+            for *key, size in self._db.execute(
+                    '''SELECT region_name, group_name, filter_pat,
+                    stream_prefix, bucket, bytes
+                    FROM buckets ORDER BY accessed''').fetchall():
+                if total <= self.max_bytes:
+                    break
+                victims.append(key)
+                total -= size
+            self._db.executemany(
+                '''DELETE FROM events WHERE region_name = ?
+                AND group_name = ? AND filter_pat = ? AND stream_prefix = ?
+                AND bucket = ?''', victims)
+            self._db.executemany(
+                '''DELETE FROM buckets WHERE region_name = ?
+                AND group_name = ? AND filter_pat = ? AND stream_prefix = ?
+                AND bucket = ?''', victims)
+
+
+def _insights_rows(results, seen=None, partial=False):
+    """Convert Insights result rows to dicts, dropping the @ptr field
+
+    With `seen`, the set of @ptr values of rows converted before, only new
+    rows are returned and their @ptr added to it. Partial results leave
+    out rows without @ptr (e.g. stats aggregates), which keep changing
+    until the query completes.
+    """
+    rows = []
+    for row in results:
+        fields = {f['field']: f['value'] for f in row}
+        ptr = fields.pop('@ptr', None)
+        if ptr is None:
+            if partial:
+                continue
+        elif seen is not None:
+            if ptr in seen:
+                continue
+            seen.add(ptr)
+        rows.append(fields)
+    return rows
+
+
+def _stop_query(cwlogs, query_id, running):
+    """Stop a running Insights query, without raising if that fails
+
+    Whoever removes the query id from `running` first stops the query, so
+    it is stopped once even when a worker and its caller both try.
+    """
+    try:
+        running.remove(query_id)
+    except KeyError:
+        return
+    try:
+        cwlogs.stop_query(queryId=query_id)
+    except Exception as err:
+        log.warning(f'Cannot stop query {query_id}: {err}')
+
+
+def run_insights_query(
+        group_names, query,
+        start, stop=None,
+        region_name=None, limit=None,
+        min_delay=0.5, max_delay=5.0,
+        on_progress=None, cwlogs=None, cancel=None, running=None,
+        on_rows=None):
+    """Run a CloudWatch Logs Insights query and wait for its results
+
+    get_query_results is polled with exponential backoff between
+    min_delay and max_delay seconds. While the query runs, on_progress is
+    called with each partial response, and on_rows(query_id, rows) with
+    the rows it returned for the first time; the final result then only
+    holds the rows not passed to on_rows. The query is stopped if polling
+    is interrupted, or once the optional `cancel` event is set, and its
+    id is kept in the optional `running` set while it runs.
+
+    :params group_names: Names of log groups to query
+    :params type: list
+
+    :params query: Logs Insights query string
+    :params type: str
+
+    :params start: Start time (epoch ms, ISO 8601 or relative time)
+    :params type: str
+
+    :params stop: End time (default: now)
+    :params type: str
+
+    :returns: Query status ('Cancelled' if cancelled), result rows and
+    statistics.
+    :rtype: dict
+    """
+    cwlogs = cwlogs or get_client('logs', region_name)
+    cancel = cancel or threading.Event()
+    running = set() if running is None else running
+    cancelled = {
+        'queryId': None,
+        'status': 'Cancelled',
+        'results': [],
+        'statistics': {}
+    }
+    params = {
+        'logGroupNames': group_names,
+        'queryString': query,
+        'startTime': parse_time(start) // 1000,
+        'endTime': parse_time(stop or 'now') // 1000
+    }
+    if limit:
+        params['limit'] = limit
+    delay = min_delay
+    while True:
+        if cancel.is_set():
+            return cancelled
+        try:
+            query_id = cwlogs.start_query(**params)['queryId']
+            break
+        except cwlogs.exceptions.LimitExceededException:
+            # Too many concurrent queries in the account; wait for a slot
+            cancel.wait(delay)
+            delay = min(delay * 2, max_delay)
+    running.add(query_id)
+    delay = min_delay
+    # @ptr of the rows passed to on_rows
+    seen = set()
+    try:
+        while True:
+            if cancel.wait(delay):
+                _stop_query(cwlogs, query_id, running)
+                return dict(cancelled, queryId=query_id)
+            res = cwlogs.get_query_results(queryId=query_id)
+            if res['status'] in _INSIGHTS_DONE:
+                break
+            if on_progress:
+                on_progress(res)
+            if on_rows:
+                rows = _insights_rows(res['results'], seen, partial=True)
+                if rows:
+                    on_rows(query_id, rows)
+            delay = min(delay * 2, max_delay)
+    except BaseException:
+        _stop_query(cwlogs, query_id, running)
+        raise
+    running.discard(query_id)
+    return {
+        'queryId': query_id,
+        'status': res['status'],
+        'results': _insights_rows(res['results'], seen),
+        'statistics': res.get('statistics', {})
+    }
+
+
+def run_insights_queries(
+        group_names, queries,
+        start, stop=None,
+        region_name=None, slices=1, limit=None,
+        max_concurrent=_INSIGHTS_MAX_CONCURRENT, on_progress=None,
+        partial=False):
+    """Run Logs Insights queries concurrently, yielding each result as
+    soon as it completes.
+
+    Every query is run over `slices` time slices of [start, stop]. Only
+    slice queries whose results can be combined (e.g. filters or counts
+    that are summed afterwards), since each slice is aggregated separately.
+
+    With partial, rows of running queries are yielded as they arrive, in
+    results with status 'Running' and no statistics, and the final result
+    of a query only holds the rows not yielded before. Aggregated rows
+    only come with the final result; with sort and limit, rows yielded
+    early may not be among the final top rows.
+
+    :params queries: Logs Insights query strings
+    :params type: list
+
+    :params slices: Number of time slices to run per query
+    :params type: int
+
+    :params max_concurrent: Maximum number of queries running at once
+    :params type: int
+
+    :params partial: Also yield the new rows of running queries
+    :params type: bool
+
+    :returns: Generator of (query, (start, stop), result) tuples.
+    :rtype: generator
+    """
+    start = parse_time(start)
+    stop = parse_time(stop or 'now')
+    bounds = split_time_range(start // 1000, stop // 1000, slices)
+    cwlogs = get_client('logs', region_name)
+    # Shared with the workers, so that an interrupt or early exit of the
+    # consumer stops the queries still running instead of waiting for them
+    cancel = threading.Event()
+    running = set()
+    # Partial rows and finished futures of the workers, in the order they
+    # happen, so a query's partial rows always come before its result
+    results = queue.Queue()
+
+    def submit(executor, key):
+        on_rows = None
+        if partial:
+            def on_rows(query_id, rows):
+                results.put((key, {
+                    'queryId': query_id,
+                    'status': 'Running',
+                    'results': rows,
+                    'statistics': {}
+                }))
+        query, (s_start, s_stop) = key
+        future = executor.submit(run_insights_query,
+            group_names, query,
+            s_start * 1000, s_stop * 1000, region_name, limit,
+            on_progress=on_progress, cwlogs=cwlogs,
+            cancel=cancel, running=running, on_rows=on_rows)
+        future.add_done_callback(lambda future: results.put((key, future)))
+        return future
+
+    with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+        futures = [
+            submit(executor, (query, time_slice))
+            for query in queries for time_slice in bounds
+        ]
+        try:
+            remaining = len(futures)
+            while remaining:
+                (query, time_slice), result = results.get()
+                if isinstance(result, Future):
+                    remaining -= 1
+                    result = result.result()
+                yield query, time_slice, result
+        finally:
+            cancel.set()
+            for future in futures:
+                future.cancel()
+            for query_id in running.copy():
+                _stop_query(cwlogs, query_id, running)
+
+
+def load_tail_checkpoint(checkpoint_file):
+    """Return the saved tail checkpoint, or None if there is none"""
+    try:
+        with open(checkpoint_file) as fh:
+            checkpoint = json.load(fh)
+        return checkpoint['timestamp'], checkpoint['event_ids']
+    except FileNotFoundError:
+        return None
+
+
+def save_tail_checkpoint(checkpoint_file, timestamp, event_ids):
+    """Atomically write the tail checkpoint
+
+    :params event_ids: Timestamps of recently seen events keyed by event ID
+    :params type: dict
+    """
+    tmp = f'{checkpoint_file}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump({'timestamp': timestamp, 'event_ids': event_ids}, fh)
+    os.replace(tmp, checkpoint_file)
+
+
+def tail_log_events(
+        group_name, filter_pat,
+        checkpoint_file=None,
+        region_name=None,
+        start=None, stream_prefix=None,
+        min_interval=1.0, max_interval=30.0,
+        lookback=_TAIL_LOOKBACK_MS):
+    """Follow a log group, yielding new events as they arrive
+
+    Polling resumes from the checkpoint (the last event timestamp and the
+    IDs of events seen within `lookback` ms of it) so events on the
+    boundary are not repeated. The checkpoint is saved to checkpoint_file
+    after every poll, and the poll interval doubles while the group is
+    quiet and halves while events keep arriving.
+
+    :params checkpoint_file: Optional path where the checkpoint is kept
+    :params type: str
+
+    :params start: Start time when there is no checkpoint (default: now)
+    :params type: str
+
+    :params min_interval: Shortest delay between polls in seconds
+    :params type: float
+
+    :params max_interval: Longest delay between polls in seconds
+    :params type: float
+
+    :params lookback: How far before the checkpoint each poll starts, in
+        milliseconds, so late-arriving events are still picked up
+    :params type: int
+    """
+    cwlogs = get_client('logs', region_name)
+    checkpoint = checkpoint_file and load_tail_checkpoint(checkpoint_file)
+    if checkpoint:
+        last_ts, seen = checkpoint
+    else:
+        last_ts, seen = parse_time(start or 'now'), {}
+    interval = min_interval
+    try:
+        while True:
+            count = 0
+            for event in _iter_log_events(cwlogs, group_name, filter_pat,
+                    max(last_ts - lookback, 0), None, stream_prefix):
+                if event['eventId'] in seen:
+                    continue
+                seen[event['eventId']] = event['timestamp']
+                last_ts = max(last_ts, event['timestamp'])
+                count += 1
+                yield event
+            # Only IDs that the next poll can return again are kept
+            seen = {
+                event_id: ts for event_id, ts in seen.items()
+                if ts >= last_ts - lookback
+            }
+            if checkpoint_file:
+                save_tail_checkpoint(checkpoint_file, last_ts, seen)
+            if count:
+                interval = max(min_interval, interval / 2)
+            else:
+                interval = min(max_interval, interval * 2)
+            time.sleep(interval)
+    finally:
+        if checkpoint_file:
+            save_tail_checkpoint(checkpoint_file, last_ts, seen)
+
    
+class CloudWatchLogsHandler(logging.Handler):
+    """Logging handler shipping records to CloudWatch Logs in batches.
+
+    emit() only appends the formatted record to an in-memory buffer; a
+    background thread sends it with PutLogEvents every `flush_interval`
+    seconds or once a full batch is waiting. Batches respect the API's
+    size, count, ordering and 24 hour span limits. When the buffer holds
+    more than `max_buffer_bytes`, new records are dropped (the default,
+    counted in `dropped`) or, with overflow='block', the caller waits for
+    space. Remaining records are flushed on close(), which logging calls
+    at interpreter shutdown.
+    """
+
+    # Records from the AWS SDK itself would be shipped by the very calls
+    # that log them
+    _IGNORED_LOGGERS = ('botocore', 'boto3', 'urllib3', 's3transfer')
+
+    def __init__(self, group_name, stream_name=None, region_name=None,
+            flush_interval=5.0, max_buffer_bytes=8 * 1024 * 1024,
+            overflow='drop', level=logging.NOTSET):
+        super().__init__(level)
+        if overflow not in ('drop', 'block'):
+            raise ValueError(f'Invalid overflow policy: {overflow}')
+        self.group_name = group_name
+        self.stream_name = stream_name or \
+            f'{socket.gethostname()}-{os.getpid()}'
+        self.flush_interval = flush_interval
+        self.max_buffer_bytes = max_buffer_bytes
+        self.overflow = overflow
+        self.dropped = 0
+        self.sent = 0
+        self._cwlogs = get_client('logs', region_name)
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._cond = threading.Condition()
+        self._flush_requested = False
+        self._flushed = 0
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name='cwlogs-handler', daemon=True)
+        self._thread.start()
+
+    def filter(self, record):
+        # Called by handle() before it takes the handler lock, so SDK
+        # records logged by the sender thread never wait behind an emit()
+        # blocked on a full buffer
+        if record.name.startswith(self._IGNORED_LOGGERS):
+            return False
+        return super().filter(record)
+
+    def emit(self, record):
+        try:
+            message = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        data = message.encode('utf-8')
+        if len(data) > _PUT_EVENT_BYTES:
+            message = data[:_PUT_EVENT_BYTES].decode('utf-8', 'ignore')
+        size = len(message.encode('utf-8')) + _PUT_EVENT_OVERHEAD
+        event = {'timestamp': int(record.created * 1000), 'message': message}
+        with self._cond:
+            if self._closed:
+                self.dropped += 1
+                return
+            while self._buffer_bytes + size > self.max_buffer_bytes:
+                if self.overflow == 'drop' or self._closed:
+                    self.dropped += 1
+                    return
+                self._cond.wait()
+            self._buffer.append((event, size))
+            self._buffer_bytes += size
+            if self._batch_ready():
+                self._cond.notify_all()
+
+    def flush(self):
+        """Wait until every record buffered so far has been sent"""
+        with self._cond:
+            if self._closed or not self._thread.is_alive():
+                return
+            target = self._flushed + 1
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._flushed < target and self._thread.is_alive():
+                self._cond.wait(1.0)
+
+    def close(self):
+        with self._cond:
+            already_closed = self._closed
+            self._closed = True
+            self._cond.notify_all()
+        if not already_closed:
+            self._thread.join()
+        super().close()
+
+    def _run(self):
+        self._ensure_stream()
+        while True:
+            with self._cond:
+                if not (self._closed or self._flush_requested
+                        or self._batch_ready()):
+                    self._cond.wait(self.flush_interval)
+                buffer, self._buffer = self._buffer, []
+                self._buffer_bytes = 0
+                flush_requested, self._flush_requested = \
+                    self._flush_requested, False
+                closed = self._closed
+                # Wake up emitters waiting for buffer space
+                self._cond.notify_all()
+            for batch in self._batches(buffer):
+                self._put(batch)
+            if flush_requested:
+                with self._cond:
+                    self._flushed += 1
+                    self._cond.notify_all()
+            if closed:
+                return
+
+    def _batch_ready(self):
+        # Start sending before a small buffer fills up and drops records
+        return (len(self._buffer) >= _PUT_BATCH_COUNT
+                or self._buffer_bytes >= min(
+                    _PUT_BATCH_BYTES, self.max_buffer_bytes // 2))
+
+    @staticmethod
+    def _batches(buffer):
+        """Split buffered events into chronological PutLogEvents batches"""
+        batch, batch_bytes = [], 0
+        for event, size in sorted(buffer, key=lambda e: e[0]['timestamp']):
+            if batch and (len(batch) == _PUT_BATCH_COUNT
+                    or batch_bytes + size > _PUT_BATCH_BYTES
+                    or event['timestamp'] - batch[0]['timestamp']
+                        >= _PUT_BATCH_SPAN_MS):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(event)
+            batch_bytes += size
+        if batch:
+            yield batch
+
+    def _ensure_stream(self):
+        for create, params in (
+                (self._cwlogs.create_log_group,
+                    {'logGroupName': self.group_name}),
+                (self._cwlogs.create_log_stream,
+                    {'logGroupName': self.group_name,
+                     'logStreamName': self.stream_name})):
+            try:
+                create(**params)
+            except self._cwlogs.exceptions.ResourceAlreadyExistsException:
+                pass
+            except Exception as err:
+                print(f'CloudWatchLogsHandler: {err}', file=sys.stderr)
+
+    def _put(self, batch):
+        try:
+            self._cwlogs.put_log_events(
+                logGroupName=self.group_name,
+                logStreamName=self.stream_name,
+                logEvents=batch
+            )
+            self.sent += len(batch)
+        except Exception as err:
+            # Never raise into the application; report like handleError
+            self.dropped += len(batch)
+            print(f'CloudWatchLogsHandler: {err}', file=sys.stderr)
+
+
+def enable_cwlogs_logging(group_name, stream_name=None, region_name=None,
+        level=logging.INFO, logger=None, **kwargs):
+    """Attach a CloudWatchLogsHandler to `logger` (default: root logger)
+
+    :returns: The attached handler.
+    :rtype: CloudWatchLogsHandler
+    """
+    logger = logger or logging.getLogger()
+    handler = CloudWatchLogsHandler(group_name, stream_name, region_name,
+        level=level, **kwargs)
+    handler.setFormatter(logging.Formatter(
+        '%(levelname)s %(module)s %(lineno)d - %(message)s'))
+    logger.addHandler(handler)
+    if logger.getEffectiveLevel() > level:
+        logger.setLevel(level)
+    return handler
+
+
 if __name__ == '__main__':
     import argparse
 
     parser = argparse.ArgumentParser()
     
+    parser.add_argument(
+        '--cwlogs_group',
+        help='Ship log records to this CloudWatch Logs group'
+    )
+    
+    parser.add_argument(
+        '--cwlogs_stream',
+        help='CloudWatch Logs stream for shipped log records\
+        (default: <hostname>-<pid>)'
+    )
+    
+    parser.add_argument(
+        '--daemon',
+        help='Forward the command to the daemon listening on this socket\
+        (default: $BOTO3_MANAGER_SOCKET)',
+        default=os.environ.get('BOTO3_MANAGER_SOCKET')
+    )
+    
+    parser.add_argument(
+        '--metrics',
+        help='Print per-operation API metrics to stderr at exit',
+        action='store_true',
+        default=False
+    )
+    
+    parser.add_argument(
+        '--metrics_format',
+        help='Format of printed metrics (default: text)',
+        choices=['text', 'json', 'prometheus'],
+        default='text'
+    )
+    
+    parser.add_argument(
+        '--output_format',
+        help='Format of listed records (default: ndjson)',
+        choices=['ndjson', 'jsonl', 'csv'],
+        default='ndjson'
+    )
+    
+    parser.add_argument(
+        '--fields',
+        help='Comma-separated fields of listed records to output,\
+        e.g. timestamp,message'
+    )
+    
     subparsers = parser.add_subparsers(
         title='Commands',
     )
@@ -72,6 +1129,19 @@ if __name__ == '__main__':
         default = 'ap-southeast-1'
     )
     
+    sp_list_log_groups.add_argument(
+        '--regions',
+        help='Comma-separated names of regions where to list log groups\
+        concurrently (overrides --region_name)'
+    )
+    
+    sp_list_log_groups.add_argument(
+        '--sort_by_last_event',
+        help='Sort log groups by last event time, most recent first',
+        action='store_true',
+        default=False
+    )
+    
     sp_list_log_groups.set_defaults(func=list_log_groups)
     
     # List log group streams subcommand
@@ -97,6 +1167,14 @@ if __name__ == '__main__':
         default = 'ap-southeast-1'
     )
     
+    sp_list_log_group_streams.add_argument(
+        '--sort_by_last_event',
+        help='Sort log streams by last event time, most recent first\
+        (cannot be combined with --stream_name)',
+        action='store_true',
+        default=False
+    )
+    
     sp_list_log_group_streams.set_defaults(func=list_log_group_streams)
     
     # Filter log events subcommand
@@ -117,12 +1195,48 @@ if __name__ == '__main__':
     
     sp_filter_log_events.add_argument(
         '--start',
-        help='Start time to filter log events'
+        help='Start time to filter log events, as epoch milliseconds,\
+        ISO 8601 timestamp or relative time (e.g. 15m, 2h, 1d)'
     )
     
     sp_filter_log_events.add_argument(
         '--stop',
-        help='End time to filter log events'
+        help='End time to filter log events, as epoch milliseconds,\
+        ISO 8601 timestamp or relative time (e.g. 15m, 2h, 1d)'
+    )
+    
+    sp_filter_log_events.add_argument(
+        '--extra_group',
+        help='Additional log group to search (may be repeated)',
+        action='append',
+        default=[]
+    )
+    
+    sp_filter_log_events.add_argument(
+        '--stream_prefix',
+        help='Log stream name prefix to search (may be repeated)',
+        action='append'
+    )
+    
+    sp_filter_log_events.add_argument(
+        '--windows',
+        help='Number of time windows to fetch concurrently\
+        (default: 1, requires --start)',
+        type=int,
+        default=1
+    )
+    
+    sp_filter_log_events.add_argument(
+        '--max_workers',
+        help='Maximum number of concurrent fetches (default: 8)',
+        type=int,
+        default=8
+    )
+    
+    sp_filter_log_events.add_argument(
+        '--cache',
+        help='SQLite file where to cache fetched log events\
+        (requires --start; not with --windows or --extra_group)'
     )
     
     sp_filter_log_events.add_argument(
@@ -134,20 +1248,270 @@ if __name__ == '__main__':
     
     sp_filter_log_events.set_defaults(func=filter_log_events)
     
+    # Tail log events subcommand
+    sp_tail_log_events = subparsers.add_parser(
+        'tail_log_events',
+        help='Follow new log events using group name and filter pattern'
+    )
+    
+    sp_tail_log_events.add_argument(
+        'group_name',
+        help='Name of log group'
+    )
+    
+    sp_tail_log_events.add_argument(
+        'filter_pat',
+        help='Pattern to use to filter log events'
+    )
+    
+    sp_tail_log_events.add_argument(
+        '--checkpoint',
+        help='File where to save and resume the tail position'
+    )
+    
+    sp_tail_log_events.add_argument(
+        '--start',
+        help='Start time when there is no checkpoint, as epoch\
+        milliseconds, ISO 8601 timestamp or relative time (default: now)'
+    )
+    
+    sp_tail_log_events.add_argument(
+        '--stream_prefix',
+        help='Log stream name prefix to follow'
+    )
+    
+    sp_tail_log_events.add_argument(
+        '--min_interval',
+        help='Shortest delay between polls in seconds (default: 1)',
+        type=float,
+        default=1.0
+    )
+    
+    sp_tail_log_events.add_argument(
+        '--max_interval',
+        help='Longest delay between polls in seconds (default: 30)',
+        type=float,
+        default=30.0
+    )
+    
+    sp_tail_log_events.add_argument(
+        '--lookback',
+        help='How far before the last event each poll starts, in seconds,\
+        so late-arriving events are still picked up (default: 5)',
+        type=float,
+        default=_TAIL_LOOKBACK_MS / 1000
+    )
+    
+    sp_tail_log_events.add_argument(
+        '--region_name',
+        help='Name of region where to tail log events\
+        (default: ap-southeast-1)',
+        default = 'ap-southeast-1'
+    )
+    
+    sp_tail_log_events.set_defaults(func=tail_log_events)
+    
+    # Logs Insights query subcommand
+    sp_insights_query = subparsers.add_parser(
+        'insights_query',
+        help='Run a CloudWatch Logs Insights query'
+    )
+    
+    sp_insights_query.add_argument(
+        'group_name',
+        help='Name of log group'
+    )
+    
+    sp_insights_query.add_argument(
+        'query',
+        help='Logs Insights query string (may be repeated with --query)'
+    )
+    
+    sp_insights_query.add_argument(
+        '--query', dest='extra_query',
+        help='Additional query to run concurrently (may be repeated)',
+        action='append',
+        default=[]
+    )
+    
+    sp_insights_query.add_argument(
+        '--extra_group',
+        help='Additional log group to query (may be repeated)',
+        action='append',
+        default=[]
+    )
+    
+    sp_insights_query.add_argument(
+        '--start',
+        help='Start time of query, as epoch milliseconds,\
+        ISO 8601 timestamp or relative time (default: 1h)',
+        default='1h'
+    )
+    
+    sp_insights_query.add_argument(
+        '--stop',
+        help='End time of query, as epoch milliseconds,\
+        ISO 8601 timestamp or relative time (default: now)'
+    )
+    
+    sp_insights_query.add_argument(
+        '--slices',
+        help='Number of time slices to run concurrently per query\
+        (default: 1)',
+        type=int,
+        default=1
+    )
+    
+    sp_insights_query.add_argument(
+        '--limit',
+        help='Maximum number of rows per query (slice)',
+        type=int
+    )
+    
+    sp_insights_query.add_argument(
+        '--max_concurrent',
+        help=f'Maximum number of queries running at once\
+        (default: {_INSIGHTS_MAX_CONCURRENT})',
+        type=int,
+        default=_INSIGHTS_MAX_CONCURRENT
+    )
+    
+    sp_insights_query.add_argument(
+        '--partial',
+        help='Write rows of running queries as they arrive (with sort and\
+        limit, some may not be among the final top rows)',
+        action='store_true',
+        default=False
+    )
+    
+    sp_insights_query.add_argument(
+        '--region_name',
+        help='Name of region where to run query\
+        (default: ap-southeast-1)',
+        default = 'ap-southeast-1'
+    )
+    
+    sp_insights_query.set_defaults(func=run_insights_queries)
+    
     args = parser.parse_args()
+    # Before any other handler, which would make basicConfig a no-op
+    logging.basicConfig(
+        level=logging.INFO,
+        format='[%(asctime)s] %(levelname)s %(module)s %(lineno)d - %(message)s'
+    )
+    if args.metrics:
+        from metrics_manager import enable_metrics
+        enable_metrics(report=args.metrics_format)
+    if args.cwlogs_group:
+        enable_cwlogs_logging(args.cwlogs_group, args.cwlogs_stream)
+    
     action = args.func.__name__ if hasattr(args, 'func') else ''
     
+    # Tailing and Insights progress stream locally; listings and event
+    # fetches are forwarded
+    if args.daemon:
+        from daemon_manager import remote
+        for name in ('iter_log_groups_multi_region', 'iter_log_group_streams',
+                'iter_log_events', 'iter_log_events_parallel'):
+            globals()[name] = remote('logs', globals()[name], args.daemon)
+    
+    fields = args.fields.split(',') if args.fields else None
+    
     if action == 'list_log_groups':
-        args.func(args.group_name, args.region_name)
+        from output_manager import write_records
+        region_names = args.regions.split(',') if args.regions \
+            else [args.region_name]
+        groups = iter_log_groups_multi_region(region_names, args.group_name,
+            args.sort_by_last_event)
+        if args.sort_by_last_event:
+            groups = sorted(groups,
+                key=lambda group: group['lastEventTimestamp'], reverse=True)
+        write_records(groups, args.output_format, fields)
     elif action == 'list_log_group_streams':
-        args.func(args.group_name, args.stream_name, args.region_name)
+        from output_manager import write_records
+        if args.sort_by_last_event and args.stream_name:
+            parser.error('--sort_by_last_event cannot be combined with'
+                ' --stream_name')
+        write_records(iter_log_group_streams(args.group_name,
+            args.stream_name, args.region_name, args.sort_by_last_event),
+            args.output_format, fields)
     elif action == 'filter_log_events':
-        args.func(args.group_name, args.filter_pat,
-            args.region_name,
-            args.start, args.stop)
+        from output_manager import write_records
+        group_names = [args.group_name] + args.extra_group
+        stream_prefixes = args.stream_prefix or []
+        cache = None
+        parallel = (args.windows > 1 or len(group_names) > 1
+            or len(stream_prefixes) > 1)
+        if args.cache and parallel:
+            parser.error('--cache cannot be combined with --windows,'
+                ' --extra_group or several --stream_prefix')
+        if args.cache and args.start is None:
+            parser.error('--cache requires --start')
+        if parallel:
+            events = iter_log_events_parallel(group_names, args.filter_pat,
+                args.start, args.stop,
+                args.region_name, stream_prefixes,
+                args.windows, args.max_workers)
+        elif args.cache:
+            cache = LogCache(args.cache)
+            events = cache.iter_log_events(args.group_name, args.filter_pat,
+                args.region_name,
+                args.start, args.stop,
+                stream_prefixes[0] if stream_prefixes else None)
+        else:
+            events = iter_log_events(args.group_name, args.filter_pat,
+                args.region_name,
+                args.start, args.stop,
+                stream_prefixes[0] if stream_prefixes else None)
+        write_records(events, args.output_format, fields)
+        if cache is not None:
+            log.info(f'Cache: {cache.stats()}')
+    elif action == 'tail_log_events':
+        from output_manager import write_records
+        try:
+            # Unbuffered, so events show up as soon as they are fetched
+            write_records(args.func(args.group_name, args.filter_pat,
+                args.checkpoint, args.region_name,
+                args.start, args.stream_prefix,
+                args.min_interval, args.max_interval,
+                int(args.lookback * 1000)),
+                args.output_format, fields, buffer_size=0)
+        except KeyboardInterrupt:
+            pass
+    elif action == 'run_insights_queries':
+        from output_manager import write_records
+        
+        def progress(res):
+            stats = res.get('statistics', {})
+            log.info(f'{res["status"]}: {stats.get("recordsMatched", 0):.0f}'
+                     f' records matched, {stats.get("bytesScanned", 0):.0f}'
+                     f' bytes scanned')
+        
+        totals = {'bytesScanned': 0}
+        
+        def rows():
+            for query, time_slice, result in args.func(
+                    [args.group_name] + args.extra_group,
+                    [args.query] + args.extra_query,
+                    args.start, args.stop,
+                    args.region_name, args.slices, args.limit,
+                    args.max_concurrent, progress, args.partial):
+                totals['bytesScanned'] += result['statistics'].get(
+                    'bytesScanned', 0)
+                # Already converted to dicts by run_insights_query
+                yield from result['results']
+                if result['status'] not in ('Complete', 'Running'):
+                    log.warning(
+                        f'Query {result["queryId"]} {result["status"]}')
+        
+        # Partial rows are written as soon as they arrive
+        unbuffered = {'buffer_size': 0} if args.partial else {}
+        write_records(rows(), args.output_format, fields, **unbuffered)
+        log.info(f'Scanned {totals["bytesScanned"]:.0f} bytes')
     else:
-        print('Invalid/Missing command.')
+        log.error('Invalid/Missing command.')
         sys.exit(1)
         
-    print('Done')
+    # On stderr, so listed records can be piped
+    log.info('Done')
        
@@ -0,0 +1,289 @@
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+
+DEFAULT_SOCKET = os.environ.get(
+    'BOTO3_MANAGER_SOCKET', f'/tmp/boto3_manager-{os.getuid()}.sock')
+
+
+class DaemonError(Exception):
+    """An operation forwarded to the daemon raised an exception"""
+
+
+class DaemonNotRunning(DaemonError):
+    """No daemon is listening on the socket"""
+
+
+# Sockets found without a daemon, which remote() no longer tries
+_not_running = set()
+
+
+def _encode(value):
+    """JSON fallback sending iterables (e.g. generators) as lists"""
+    try:
+        return list(value)
+    except TypeError:
+        return str(value)
+
+
+def _result(response):
+    """Replay the captured log records and stdout of a response and
+    return its result"""
+    for fields in response.get('logs', []):
+        record = logging.makeLogRecord(fields)
+        logger = logging.getLogger(record.name)
+        if logger.isEnabledFor(record.levelno):
+            logger.handle(record)
+    if response.get('stdout'):
+        sys.stdout.write(response['stdout'])
+    if response['status'] != 'ok':
+        raise DaemonError(response['error'])
+    return response.get('result')
+
+
+def _read(fh):
+    line = fh.readline()
+    if not line:
+        raise DaemonError('The daemon closed the connection.')
+    return json.loads(line)
+
+
+def _iter_records(sock, fh):
+    """Yield the records of a streamed result as they arrive"""
+    with sock, fh:
+        while True:
+            response = _read(fh)
+            if 'record' not in response:
+                _result(response)
+                return
+            yield response['record']
+
+
+def call(service, op, args=(), kwargs=None, socket_path=DEFAULT_SOCKET):
+    """Run a manager function in the daemon and return its result
+
+    Anything the function prints or logs in the daemon is printed or
+    logged here. Results come back JSON-decoded, with non-JSON values
+    converted to strings.
+    Generator results come back as a generator yielding the records as
+    the daemon produces them, so neither side holds them all in memory.
+    """
+    request = {
+        'service': service,
+        'op': op,
+        'args': list(args),
+        'kwargs': kwargs or {}
+    }
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            raise DaemonNotRunning(
+                f'No daemon is running on {socket_path}') from None
+        sock.sendall(
+            json.dumps(request, default=_encode).encode('utf-8') + b'\n')
+        fh = sock.makefile('rb')
+        response = _read(fh)
+    except BaseException:
+        sock.close()
+        raise
+    if response.get('stream'):
+        # The socket is closed once the records are consumed
+        return _iter_records(sock, fh)
+    fh.close()
+    sock.close()
+    return _result(response)
+
+
+def remote(service, func, socket_path=DEFAULT_SOCKET):
+    """Return a stand-in for a manager function that runs it in the daemon
+
+    The stand-in keeps the function's __name__ so the CLIs can dispatch on
+    it unchanged. Without a daemon on the socket, the function runs
+    locally instead.
+    """
+    def call_remote(*args, **kwargs):
+        if socket_path not in _not_running:
+            try:
+                return call(service, func.__name__, args, kwargs,
+                    socket_path)
+            except DaemonNotRunning as err:
+                _not_running.add(socket_path)
+                print(f'{err}, running locally', file=sys.stderr)
+        return func(*args, **kwargs)
+
+    call_remote.__name__ = func.__name__
+    call_remote.__doc__ = func.__doc__
+    return call_remote
+
+
+class _ThreadLogs(logging.Handler):
+    """Handler collecting the log records of request threads, so they
+    can be sent back to the client"""
+
+    def __init__(self):
+        super().__init__()
+        self._local = threading.local()
+
+    def capture(self):
+        self._local.records = []
+
+    # Not release(), which is the Handler's lock release
+    def collect(self):
+        return self._local.__dict__.pop('records', [])
+
+    def emit(self, record):
+        records = getattr(self._local, 'records', None)
+        if records is None:
+            return
+        message = record.getMessage()
+        if record.exc_info:
+            message += '\n' + logging.Formatter().formatException(
+                record.exc_info)
+        records.append({
+            'name': record.name,
+            'msg': message,
+            'levelno': record.levelno,
+            'levelname': record.levelname,
+            'pathname': record.pathname,
+            'filename': record.filename,
+            'module': record.module,
+            'lineno': record.lineno,
+            'funcName': record.funcName,
+            'created': record.created,
+            'msecs': record.msecs,
+        })
+
+
+def serve(socket_path=DEFAULT_SOCKET, max_workers=16):
+    """Serve manager operations on a Unix domain socket until interrupted
+
+    Clients, the bucket metadata cache and connection pools stay
+    warm between requests. Each connection is handled in its own thread,
+    with at most max_workers operations running at once. Records logged
+    by that thread (not by worker pools of the operation) are sent back
+    to the client with the response.
+    """
+    import socketserver
+
+    from batch_runner import SERVICES, run_operation, warm_clients
+    from output_manager import dumps
+
+    slots = threading.BoundedSemaphore(max_workers)
+    logs = _ThreadLogs()
+    root = logging.getLogger()
+    root.addHandler(logs)
+    if root.getEffectiveLevel() > logging.INFO:
+        root.setLevel(logging.INFO)
+
+    class Handler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    operation = {
+                        'id': request.get('id', '0'),
+                        'service': request['service'],
+                        'op': request['op'],
+                        'args': request.get('args', []),
+                        'kwargs': request.get('kwargs', {})
+                    }
+                    if operation['service'] not in SERVICES \
+                            or operation['op'].startswith('_'):
+                        raise ValueError(
+                            f'Invalid operation {operation["service"]}.'
+                            f'{operation["op"]}')
+                except (ValueError, KeyError, AttributeError) as err:
+                    response = {'status': 'failed', 'error': f'{err}'}
+                else:
+                    # Prints of the operation come back in 'stdout'
+                    with slots:
+                        logs.capture()
+                        try:
+                            response = run_operation(operation, self.stream)
+                        finally:
+                            records = logs.collect()
+                    if records:
+                        response['logs'] = records
+                try:
+                    self.wfile.write(dumps(response) + b'\n')
+                    self.wfile.flush()
+                except OSError:
+                    # The client went away, e.g. stopped reading records
+                    return
+
+        def stream(self, records):
+            """Send generator results one record per line, as the client
+            reads them, after a line announcing the stream"""
+            count = 0
+            try:
+                self.wfile.write(b'{"stream":true}\n')
+                for record in records:
+                    self.wfile.write(dumps({'record': record}) + b'\n')
+                    count += 1
+            finally:
+                # e.g. stops the Insights queries of an abandoned stream
+                records.close()
+            return count
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    if os.path.exists(socket_path):
+        # A leftover socket from a previous daemon, unless one is running
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(socket_path)
+            raise RuntimeError(f'A daemon is already serving {socket_path}')
+        except ConnectionRefusedError:
+            os.unlink(socket_path)
+
+    warm_clients([{'service': service} for service in SERVICES])
+    old_umask = os.umask(0o177)
+    try:
+        server = Server(socket_path, Handler)
+    finally:
+        os.umask(old_umask)
+    print(f'Serving on {socket_path}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Run a warm daemon executing manager operations'
+    )
+
+    parser.add_argument(
+        '--socket',
+        help=f'Path of Unix domain socket (default: {DEFAULT_SOCKET})',
+        default=DEFAULT_SOCKET
+    )
+
+    parser.add_argument(
+        '--max_workers',
+        help='Maximum number of operations running at once (default: 16)',
+        type=int,
+        default=16
+    )
+
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='[%(asctime)s] %(levelname)s %(module)s %(lineno)d - %(message)s'
+    )
+    serve(args.socket, args.max_workers)
@@ -1,13 +1,23 @@
 import json
+import os
 import sys
 from decimal import Decimal
 import random
+import logging
 
-import boto3
 import operator as op
-from boto3.dynamodb.conditions import Key, Attr
 
-_dyn_client = boto3.resource('dynamodb')
+from client_manager import get_resource
+from retry_manager import get_policy
+
+log = logging.getLogger(__name__)
+
+# BatchWriteItem accepts at most 25 put or delete requests
+_BATCH_WRITE_SIZE = 25
+
+
+def _dyn_client():
+    return get_resource('dynamodb')
 
 
 def parse_tabledef(conf_file):
@@ -25,7 +35,7 @@ def parse_tabledef(conf_file):
 
 
 def create_dynamo_table(table_name, pk, pkdef):
-    table = _dyn_client.create_table(
+    table = _dyn_client().create_table(
         TableName=table_name,
         KeySchema=pk,
         AttributeDefinitions=pkdef,
@@ -35,12 +45,13 @@ def create_dynamo_table(table_name, pk, pkdef):
         }
     )
     table.meta.client.get_waiter('table_exists').wait(TableName=table_name)
+    log.info(f'Created table {table_name}')
     return table
 
 
 def get_dynamo_table(table_name):
-    return _dyn_client.Table(table_name)
-#    print(_dyn_client.Table(table_name))
+    return _dyn_client().Table(table_name)
+#    print(_dyn_client().Table(table_name))
 
 
 def parse_productdef(prod_file):
@@ -121,22 +132,79 @@ def create_random_items(n_items):
     return items
 
 
+def chunk_items(items, keys=None):
+    """Split items into BatchWriteItem sized batches
+
+    With keys, an item replaces a buffered item with the same key values
+    (like batch_writer's overwrite_by_pkeys), as a batch must not contain
+    duplicate keys.
+    """
+    batch = {}
+    for idx, item in enumerate(items):
+        key = tuple(item[k] for k in keys) if keys else idx
+        if key not in batch and len(batch) == _BATCH_WRITE_SIZE:
+            yield list(batch.values())
+            batch = {}
+        batch[key] = item
+    if batch:
+        yield list(batch.values())
+
+
+def batch_write_items(table, items):
+    """Write up to 25 items, retrying unprocessed items with backoff
+
+    :returns: Number of items left unprocessed after all retries.
+    :rtype: int
+    """
+    policy = get_policy('dynamodb')
+    pending = {
+        table.name: [{'PutRequest': {'Item': item}} for item in items]
+    }
+    for attempt in range(policy.retries + 1):
+        res = policy.call(
+            table.meta.client.batch_write_item,
+            RequestItems=pending
+        )
+        pending = res.get('UnprocessedItems')
+        if not pending:
+            return 0
+        if attempt == policy.retries:
+            policy.give_up()
+            break
+        log.warning(f'Retrying {len(pending[table.name])} unprocessed items')
+        policy.backoff(attempt)
+    return sum(len(requests) for requests in pending.values())
+
+
 def create_dynamo_items(table_name, n_items, keys=None):
     table = get_dynamo_table(table_name)
     items = create_random_items(n_items)
-    params = {
-        'overwrite_by_pkeys': keys
-    } if keys else {}
-    
-    with table.batch_writer(**params) as batch:
-        for item in items:
-            batch.put_item(Item=item)
+
+    unprocessed = 0
+    for batch in chunk_items(items, keys):
+        unprocessed += batch_write_items(table, batch)
+    if unprocessed:
+        raise RuntimeError(
+            f'{unprocessed} items were not written to {table_name}')
+    log.info(f'Wrote {n_items} items to {table_name}')
     return True
 
 
-def query_products(table_name, pk_value, 
+def _iter_items(method, params):
+    """Yield items of a query or scan, following LastEvaluatedKey"""
+    while True:
+        res = method(**params)
+        yield from res['Items']
+        if 'LastEvaluatedKey' not in res:
+            return
+        params['ExclusiveStartKey'] = res['LastEvaluatedKey']
+
+
+def iter_query_products(table_name, pk_value,
         sk_value=None, sk_condition=None,
         attr_name=None, attr_condition=None, attr_value=None):
+    """Yield the items matching a query, page by page"""
+    from boto3.dynamodb.conditions import Key, Attr
         
     table = get_dynamo_table(table_name)
     key_expr = Key('category').eq(pk_value)
@@ -153,13 +221,22 @@ def query_products(table_name, pk_value,
 #    breakpoint()    
         params['FilterExpression'] = filter_expr
         
-    res = table.query(**params)
-    return res['Items']
+    yield from _iter_items(table.query, params)
+
+
+def query_products(table_name, pk_value, 
+        sk_value=None, sk_condition=None,
+        attr_name=None, attr_condition=None, attr_value=None):
+    return list(iter_query_products(table_name, pk_value,
+        sk_value, sk_condition,
+        attr_name, attr_condition, attr_value))
 #    print(res['Items'])
 
 
-def scan_products(table_name,
+def iter_scan_products(table_name,
         attr_name, attr_condition, attr_value):
+    """Yield the items matching a scan filter, page by page"""
+    from boto3.dynamodb.conditions import Attr
         
     table = get_dynamo_table(table_name)
     filter_expr = getattr(Attr(attr_name), attr_condition)(attr_value)
@@ -167,20 +244,64 @@ def scan_products(table_name,
     params = {
         'FilterExpression': filter_expr
     }
-    res = table.scan(**params)
-    return res['Items']
+    yield from _iter_items(table.scan, params)
+
+
+def scan_products(table_name,
+        attr_name, attr_condition, attr_value):
+    return list(iter_scan_products(table_name,
+        attr_name, attr_condition, attr_value))
 #    print(res['Items'])
     
 def delete_dynamo_table(table_name):
     table = get_dynamo_table(table_name)
     table.delete()
     table.wait_until_not_exists()
+    log.info(f'Deleted table {table_name}')
     return True
 
 
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--cwlogs_group',
+        help='Ship log records to this CloudWatch Logs group',
+    )
+    parser.add_argument(
+        '--cwlogs_stream',
+        help='CloudWatch Logs stream for shipped log records\
+        (default: <hostname>-<pid>)',
+    )
+    parser.add_argument(
+        '--daemon',
+        help='Forward the command to the daemon listening on this socket\
+        (default: $BOTO3_MANAGER_SOCKET)',
+        default=os.environ.get('BOTO3_MANAGER_SOCKET'),
+    )
+    parser.add_argument(
+        '--metrics',
+        help='Print per-operation API metrics to stderr at exit',
+        action='store_true',
+        default=False,
+    )
+    parser.add_argument(
+        '--metrics_format',
+        help='Format of printed metrics (default: text)',
+        choices=['text', 'json', 'prometheus'],
+        default='text',
+    )
+    parser.add_argument(
+        '--output_format',
+        help='Format of listed records (default: ndjson)',
+        choices=['ndjson', 'jsonl', 'csv'],
+        default='ndjson',
+    )
+    parser.add_argument(
+        '--fields',
+        help='Comma-separated fields of listed records to output,\
+        e.g. sku,price',
+    )
     subparsers = parser.add_subparsers(
         title='Commands',
     )
@@ -346,7 +467,24 @@ if __name__ == '__main__':
 
     # Execute subcommand function
     args = parser.parse_args()
+    # Before any other handler, which would make basicConfig a no-op
+    logging.basicConfig(
+        level=logging.INFO,
+        format='[%(asctime)s] %(levelname)s %(module)s %(lineno)d - %(message)s'
+    )
+    if args.metrics:
+        from metrics_manager import enable_metrics
+        enable_metrics(report=args.metrics_format)
+    if args.cwlogs_group:
+        from cwlogs_manager import enable_cwlogs_logging
+        enable_cwlogs_logging(args.cwlogs_group, args.cwlogs_stream)
     action = args.func.__name__ if hasattr(args, 'func') else ''
+    if args.daemon and action:
+        from daemon_manager import remote
+        args.func = remote('dynamodb', args.func, args.daemon)
+        for name in ('iter_query_products', 'iter_scan_products'):
+            globals()[name] = remote('dynamodb', globals()[name], args.daemon)
+    fields = args.fields.split(',') if args.fields else None
     if action == 'delete_dynamo_table':
         args.func(args.table_name)
     elif action == 'create_dynamo_table':
@@ -363,15 +501,20 @@ if __name__ == '__main__':
     elif action == 'create_dynamo_items':
         args.func(args.table_name, int(args.n_items))
     elif action == 'query_products':
-        args.func(args.table_name, args.pk_value,
+        from output_manager import write_records
+        write_records(iter_query_products(args.table_name, args.pk_value,
             args.sk_value, args.sk_condition,
-            args.attr_name, args.attr_condition, args.attr_value)
+            args.attr_name, args.attr_condition, args.attr_value),
+            args.output_format, fields)
     elif action == 'scan_products':
-        args.func(args.table_name, 
-        args.attr_name, args.attr_condition, args.attr_value)
+        from output_manager import write_records
+        write_records(iter_scan_products(args.table_name, 
+            args.attr_name, args.attr_condition, args.attr_value),
+            args.output_format, fields)
     else:
-        print('Invalid/Missing command.')
+        log.error('Invalid/Missing command.')
         sys.exit(1)
 
-    print('Done')
+    # On stderr, so listed records can be piped
+    log.info('Done')
 
@@ -0,0 +1,340 @@
+import atexit
+import json
+import sys
+import threading
+import time
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+    float('inf')
+)
+
+THROTTLE_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'BandwidthLimitExceeded',
+    'LimitExceededException',
+    'SlowDown',
+    'PriorRequestNotComplete',
+}
+
+_COUNTERS = (
+    'requests', 'errors', 'retries', 'throttles',
+    'bytes_sent', 'bytes_received'
+)
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+class Metrics:
+    """Thread-safe per-operation request metrics
+
+    Counters and a latency histogram are kept per (service, operation).
+    DynamoDB consumed capacity is kept per table, and retry decisions
+    made outside botocore are counted per (service, decision).
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._operations = {}
+        self._capacity = {}
+        self._decisions = {}
+
+    def _operation(self, service, operation):
+        key = (service, operation)
+        stats = self._operations.get(key)
+        if stats is None:
+            stats = dict.fromkeys(_COUNTERS, 0)
+            stats.update(
+                latency_sum=0.0,
+                latency_max=0.0,
+                histogram=[0] * len(self.buckets)
+            )
+            self._operations[key] = stats
+        return stats
+
+    def observe(self, service, operation, latency, error=False, retries=0):
+        """Record one API call and its total latency in seconds"""
+        with self._lock:
+            stats = self._operation(service, operation)
+            stats['requests'] += 1
+            stats['errors'] += int(error)
+            stats['retries'] += retries
+            stats['latency_sum'] += latency
+            stats['latency_max'] = max(stats['latency_max'], latency)
+            for idx, bound in enumerate(self.buckets):
+                if latency <= bound:
+                    stats['histogram'][idx] += 1
+                    break
+
+    def incr(self, service, operation, counter, value=1):
+        with self._lock:
+            self._operation(service, operation)[counter] += value
+
+    def add_capacity(self, table_name, units):
+        with self._lock:
+            self._capacity[table_name] = \
+                self._capacity.get(table_name, 0.0) + units
+
+    def record_decision(self, service, decision):
+        """Count a retry, backoff or circuit breaker decision"""
+        with self._lock:
+            key = (service, decision)
+            self._decisions[key] = self._decisions.get(key, 0) + 1
+
+    def _percentile(self, stats, quantile):
+        """Estimate a latency percentile from the histogram bucket bounds"""
+        target = quantile * stats['requests']
+        cumulative = 0
+        for bound, count in zip(self.buckets, stats['histogram']):
+            cumulative += count
+            if cumulative >= target and count:
+                return min(bound, stats['latency_max'])
+        return stats['latency_max']
+
+    def summary(self):
+        """Return all metrics as a JSON-serializable dict"""
+        with self._lock:
+            operations = []
+            for (service, operation), stats in sorted(
+                    self._operations.items()):
+                count = stats['requests']
+                summary = {
+                    'service': service,
+                    'operation': operation,
+                }
+                summary.update({c: stats[c] for c in _COUNTERS})
+                summary.update(
+                    latency_mean=stats['latency_sum'] / count
+                        if count else 0.0,
+                    latency_p50=self._percentile(stats, 0.5),
+                    latency_p99=self._percentile(stats, 0.99),
+                    latency_max=stats['latency_max']
+                )
+                operations.append(summary)
+            return {
+                'elapsed': time.time() - self.started,
+                'operations': operations,
+                'dynamodb_consumed_capacity': dict(self._capacity),
+                'decisions': [
+                    {'service': service, 'decision': decision, 'count': n}
+                    for (service, decision), n in sorted(
+                        self._decisions.items())
+                ]
+            }
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2)
+
+    def to_text(self):
+        """Return a human-readable table of the metrics"""
+        summary = self.summary()
+        lines = [
+            f'{"operation":<40} {"calls":>7} {"errors":>6} {"retries":>7}'
+            f' {"throttles":>9} {"mean ms":>8} {"p99 ms":>8}'
+            f' {"sent":>10} {"received":>10}'
+        ]
+        for op in summary['operations']:
+            name = f'{op["service"]}.{op["operation"]}'
+            lines.append(
+                f'{name:<40} {op["requests"]:>7} {op["errors"]:>6}'
+                f' {op["retries"]:>7} {op["throttles"]:>9}'
+                f' {op["latency_mean"] * 1000:>8.1f}'
+                f' {op["latency_p99"] * 1000:>8.1f}'
+                f' {op["bytes_sent"]:>10} {op["bytes_received"]:>10}'
+            )
+        for table, units in summary['dynamodb_consumed_capacity'].items():
+            lines.append(f'DynamoDB {table}: {units:.1f} capacity units')
+        for decision in summary['decisions']:
+            lines.append(
+                f'{decision["service"]} {decision["decision"]}:'
+                f' {decision["count"]}')
+        return '\n'.join(lines)
+
+    def to_prometheus(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        prefix = 'boto3_manager'
+        with self._lock:
+            operations = sorted(
+                (key, dict(stats, histogram=list(stats['histogram'])))
+                for key, stats in self._operations.items())
+            capacity = dict(self._capacity)
+            decisions = dict(self._decisions)
+        lines = [f'# TYPE {prefix}_request_duration_seconds histogram']
+        for (service, operation), stats in operations:
+            labels = f'service="{service}",operation="{operation}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, stats['histogram']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound}'
+                lines.append(
+                    f'{prefix}_request_duration_seconds_bucket'
+                    f'{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_request_duration_seconds_sum'
+                         f'{{{labels}}} {stats["latency_sum"]}')
+            lines.append(f'{prefix}_request_duration_seconds_count'
+                         f'{{{labels}}} {stats["requests"]}')
+        for counter in _COUNTERS[1:]:
+            lines.append(f'# TYPE {prefix}_{counter}_total counter')
+            for (service, operation), stats in operations:
+                lines.append(
+                    f'{prefix}_{counter}_total{{service="{service}",'
+                    f'operation="{operation}"}} {stats[counter]}')
+        lines.append(
+            f'# TYPE {prefix}_dynamodb_consumed_capacity_total counter')
+        for table, units in sorted(capacity.items()):
+            lines.append(
+                f'{prefix}_dynamodb_consumed_capacity_total'
+                f'{{table="{table}"}} {units}')
+        lines.append(f'# TYPE {prefix}_decisions_total counter')
+        for (service, decision), count in sorted(decisions.items()):
+            lines.append(
+                f'{prefix}_decisions_total{{service="{service}",'
+                f'decision="{decision}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _event_names(event_name):
+    """Return (service, operation) from e.g. 'after-call.s3.GetObject'"""
+    parts = event_name.split('.')
+    return parts[1], parts[2]
+
+
+def _content_length(headers):
+    try:
+        return int(headers.get('content-length')
+                   or headers.get('Content-Length') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def instrument_client(client, metrics):
+    """Register botocore event handlers recording metrics for a client"""
+    events = client.meta.events
+
+    def request_consumed_capacity(params, model, **kwargs):
+        if 'ReturnConsumedCapacity' in model.input_shape.members:
+            params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+    def before_call(context, **kwargs):
+        context['metrics_start'] = time.perf_counter()
+
+    def after_call(event_name, http_response, parsed, context, **kwargs):
+        service, operation = _event_names(event_name)
+        start = context.pop('metrics_start', None)
+        if start is None:
+            return
+        metrics.observe(
+            service, operation,
+            time.perf_counter() - start,
+            error=http_response.status_code >= 300,
+            retries=parsed.get('ResponseMetadata', {}).get(
+                'RetryAttempts', 0)
+        )
+        capacity = parsed.get('ConsumedCapacity')
+        for entry in capacity if isinstance(capacity, list) else [capacity]:
+            if entry:
+                metrics.add_capacity(
+                    entry.get('TableName', ''), entry.get('CapacityUnits', 0))
+
+    def after_call_error(event_name, context, **kwargs):
+        service, operation = _event_names(event_name)
+        start = context.pop('metrics_start', None)
+        if start is not None:
+            metrics.observe(service, operation,
+                time.perf_counter() - start, error=True)
+
+    def request_created(event_name, request, **kwargs):
+        body = request.body
+        if isinstance(body, (bytes, str)):
+            size = len(body)
+        else:
+            size = _content_length(request.headers)
+        if size:
+            metrics.incr(*_event_names(event_name), 'bytes_sent', size)
+
+    def response_received(event_name, response_dict, parsed_response,
+            **kwargs):
+        # Emitted once per attempt, so throttled attempts that were
+        # retried successfully are counted too
+        service, operation = _event_names(event_name)
+        if response_dict:
+            size = _content_length(response_dict.get('headers', {}))
+            if size:
+                metrics.incr(service, operation, 'bytes_received', size)
+        code = (parsed_response or {}).get('Error', {}).get('Code')
+        if code in THROTTLE_CODES:
+            metrics.incr(service, operation, 'throttles')
+
+    unique = f'metrics-{id(metrics)}'
+    if client.meta.service_model.service_name == 'dynamodb':
+        events.register('before-parameter-build.dynamodb',
+            request_consumed_capacity, unique_id=f'{unique}-capacity')
+    events.register('before-call', before_call,
+        unique_id=f'{unique}-before-call')
+    events.register('after-call', after_call,
+        unique_id=f'{unique}-after-call')
+    events.register('after-call-error', after_call_error,
+        unique_id=f'{unique}-after-call-error')
+    events.register('request-created', request_created,
+        unique_id=f'{unique}-request-created')
+    events.register('response-received', response_received,
+        unique_id=f'{unique}-response-received')
+
+
+def get_metrics():
+    """Return the process-wide metrics, or None if not enabled"""
+    return _metrics
+
+
+def enable_metrics(report=None, file=None):
+    """Record metrics for every client of the shared client registry
+
+    :params report: Optional format (text, json or prometheus) in which
+    to print the metrics at exit
+    :params type: str
+
+    :params file: Path where the report is written (default: stderr)
+    :params type: str
+
+    :returns: The process-wide metrics.
+    :rtype: Metrics
+    """
+    global _metrics
+    from client_manager import add_client_hook
+
+    with _metrics_lock:
+        if _metrics is not None:
+            return _metrics
+        _metrics = Metrics()
+    add_client_hook(lambda client: instrument_client(client, _metrics))
+    if report:
+        atexit.register(write_report, report, file)
+    return _metrics
+
+
+def write_report(fmt='text', file=None):
+    """Write the metrics as text, json or prometheus"""
+    if _metrics is None:
+        return
+    render = {
+        'text': _metrics.to_text,
+        'json': _metrics.to_json,
+        'prometheus': _metrics.to_prometheus,
+    }[fmt]
+    output = render()
+    if file:
+        with open(file, 'w') as fh:
+            fh.write(output)
+    else:
+        print(output, file=sys.stderr)
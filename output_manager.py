@@ -0,0 +1,237 @@
+import base64
+import csv
+import io
+import json
+import os
+import re
+import sys
+from datetime import date, datetime
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# NDJSON and JSON Lines are the same format under two names
+FORMATS = ('ndjson', 'jsonl', 'csv')
+
+_BUFFER_SIZE = 64 * 1024
+
+
+def json_default(value):
+    """JSON fallback for DynamoDB and boto3 values
+
+    Integral decimals become ints and other decimals strings (so no
+    digits are lost), datetimes ISO 8601 strings, sets lists and binary
+    values base64 strings.
+    """
+    if isinstance(value, Decimal):
+        if value.is_finite() and value == value.to_integral_value():
+            return int(value)
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    # boto3.dynamodb.types.Binary wraps the bytes in .value
+    value = getattr(value, 'value', value)
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode('ascii')
+    return str(value)
+
+
+# DynamoDB numbers have up to 38 digits, so non-integral decimals are
+# written exactly as JSON numbers, not through floats: orjson writes
+# Fragments as they are, otherwise they are encoded as marked strings
+# that are unquoted after encoding
+_Fragment = getattr(orjson, 'Fragment', None)
+_DECIMAL_MARK = f'\x00{os.urandom(4).hex()}:'
+_MARKED_DECIMAL = re.compile(
+    rb'"\\u0000' + _DECIMAL_MARK[1:].encode('ascii') + rb'([^"]*)"')
+
+
+def _is_fraction(value):
+    return (isinstance(value, Decimal) and value.is_finite()
+        and value != value.to_integral_value())
+
+
+def _marked_default(value):
+    if _is_fraction(value):
+        return _DECIMAL_MARK + str(value)
+    return json_default(value)
+
+
+def _orjson_default(value):
+    if _Fragment is not None and _is_fraction(value):
+        return _Fragment(str(value))
+    return _marked_default(value)
+
+
+def _unmark(data):
+    if b'\\u0000' + _DECIMAL_MARK[1:].encode('ascii') in data:
+        return _MARKED_DECIMAL.sub(rb'\1', data)
+    return data
+
+
+_encoder = json.JSONEncoder(
+    default=_marked_default,
+    ensure_ascii=False,
+    separators=(',', ':')
+)
+
+
+def dumps(obj):
+    """Encode obj as compact UTF-8 JSON, using orjson when installed
+
+    :rtype: bytes
+    """
+    if orjson is not None:
+        try:
+            return _unmark(orjson.dumps(obj, default=_orjson_default))
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits, which the json module handles
+            pass
+    return _unmark(_encoder.encode(obj).encode('utf-8'))
+
+
+def select_fields(record, fields):
+    """Return the given fields of a record, following dotted paths into
+    nested mappings. Missing fields are None.
+    """
+    selected = {}
+    for field in fields:
+        value = record
+        for part in field.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        selected[field] = value
+    return selected
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (dict, list, tuple, set, frozenset)):
+        return dumps(value).decode('utf-8')
+    if isinstance(value, date):
+        return value.isoformat()
+    # Decimals are written exactly by csv's str()
+    return value
+
+
+class OutputWriter:
+    """Buffered NDJSON/JSON Lines or CSV writer for streams of records
+
+    Records are encoded as they are written and sent to the file in
+    chunks of about `buffer_size` bytes; a buffer_size of 0 writes every
+    record immediately (e.g. when tailing). CSV columns are the selected
+    fields, or the keys of the first record.
+
+    Usage::
+
+        with OutputWriter(fmt='csv', fields=['category', 'sku']) as out:
+            for item in items:
+                out.write(item)
+    """
+
+    def __init__(self, file=None, fmt='ndjson', fields=None,
+            buffer_size=_BUFFER_SIZE):
+        if fmt not in FORMATS:
+            raise ValueError(f'Unknown output format {fmt}')
+        self.fmt = fmt
+        self.fields = fields
+        self.buffer_size = buffer_size
+        self.count = 0
+        if file in (None, '-'):
+            # run_operation replaces sys.stdout with a text-only stream
+            self._file = getattr(sys.stdout, 'buffer', sys.stdout)
+            self._owned = False
+        else:
+            self._file = open(file, 'wb')
+            self._owned = True
+        self._binary = not isinstance(self._file, io.TextIOBase)
+        self._chunks = []
+        self._size = 0
+        self._csv_buffer = io.StringIO()
+        self._csv = csv.writer(self._csv_buffer, lineterminator='\n')
+        self._columns = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, record):
+        if self.fields:
+            record = select_fields(record, self.fields)
+        if self.fmt == 'csv':
+            if self._columns is None:
+                self._columns = list(self.fields or record)
+                self._csv.writerow(self._columns)
+            self._csv.writerow(
+                [_csv_value(record.get(c)) for c in self._columns])
+            size = self._csv_buffer.tell()
+        else:
+            line = dumps(record) + b'\n'
+            self._chunks.append(line)
+            self._size += len(line)
+            size = self._size
+        self.count += 1
+        if size >= self.buffer_size:
+            self.flush()
+
+    def write_all(self, records):
+        """Write all records, returning the number written so far"""
+        for record in records:
+            self.write(record)
+        return self.count
+
+    def flush(self):
+        if self.fmt == 'csv':
+            data = self._csv_buffer.getvalue().encode('utf-8')
+            self._csv_buffer.seek(0)
+            self._csv_buffer.truncate()
+        else:
+            data = b''.join(self._chunks)
+            self._chunks = []
+            self._size = 0
+        if data:
+            self._file.write(data if self._binary else data.decode('utf-8'))
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        if self._owned:
+            self._file.close()
+
+
+def write_records(records, fmt='ndjson', fields=None, file=None,
+        buffer_size=_BUFFER_SIZE):
+    """Stream records to stdout (or a file) as NDJSON, JSON Lines or CSV
+
+    Writing stops quietly when the reader of stdout goes away, e.g. when
+    piped into head.
+
+    :params records: Iterable of records (mappings), consumed lazily
+    :params type: iterable
+
+    :params fields: Optional fields to keep, with dotted paths for nested
+    fields (e.g. ['logGroupName', 'metricFilterCount'])
+    :params type: list
+
+    :returns: Number of records written.
+    :rtype: int
+    """
+    writer = OutputWriter(file, fmt, fields, buffer_size)
+    try:
+        writer.write_all(records)
+        writer.close()
+    except BrokenPipeError:
+        # Python flushes stdout again at exit, so point it at devnull
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
+    return writer.count
@@ -0,0 +1,282 @@
+import json
+import os
+import random
+import threading
+import time
+
+from metrics_manager import THROTTLE_CODES, get_metrics
+
+# Settings of every service's policy, overridden per service below and by
+# BOTO3_MANAGER_RETRY_POLICY, a JSON object mapping service names (or '*'
+# for all services) to settings, e.g. '{"sns": {"rate": 100}}'
+DEFAULT_POLICY = {
+    # botocore retries of whole requests, with jittered backoff. Adaptive
+    # mode also rate limits the client once it is throttled, which helps
+    # against sustained throttling but slows down a lot on sporadic one
+    'retry_mode': 'standard',
+    'max_attempts': 5,
+    # Retries of partial failures (unprocessed items, failed batch
+    # entries), with full jitter exponential backoff
+    'retries': 3,
+    'base_delay': 0.05,
+    'max_delay': 5.0,
+    # Client-side calls per second, None for no limit
+    'rate': None,
+    'burst': None,
+    # Consecutive failed calls opening the circuit, and seconds before a
+    # trial call is let through
+    'failure_threshold': 5,
+    'reset_timeout': 30.0,
+}
+
+_SERVICE_POLICIES = {
+    # botocore's legacy retry handler makes 10 attempts for DynamoDB
+    'dynamodb': {'max_attempts': 10},
+}
+
+# Error codes worth retrying, also in per-item errors of batch operations
+RETRYABLE_CODES = THROTTLE_CODES | {
+    'InternalError',
+    'InternalFailure',
+    'InternalServerError',
+    'ServiceUnavailable',
+}
+
+_policies = {}
+_overrides = json.loads(os.environ.get('BOTO3_MANAGER_RETRY_POLICY', '{}'))
+_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """The circuit breaker of a service is open, so the call was not made"""
+
+
+def _decide(service, decision):
+    """Report a retry, backoff or circuit breaker decision to the metrics"""
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.record_decision(service, decision)
+
+
+def is_retryable(err):
+    """Return True for throttling errors and server-side failures"""
+    response = getattr(err, 'response', None)
+    if not isinstance(response, dict):
+        return False
+    code = response.get('Error', {}).get('Code')
+    status = response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+    return code in RETRYABLE_CODES or status >= 500
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` calls per second with
+    bursts of up to `burst` calls.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Take tokens, waiting for them if needed
+
+        :returns: Seconds spent waiting.
+        :rtype: float
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class CircuitBreaker:
+    """Thread-safe circuit breaker of one service
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    calls are refused for `reset_timeout` seconds. Then a single trial call
+    is let through (half open): its success closes the circuit, its
+    failure opens it again.
+    """
+
+    def __init__(self, service, failure_threshold=5, reset_timeout=30.0):
+        self.service = service
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self._failures = 0
+        self._opened = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may be made now"""
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self._opened < self.reset_timeout:
+                    return False
+                self.state = 'half_open'
+                _decide(self.service, 'circuit_half_open')
+            if self.state == 'half_open':
+                if self._trial:
+                    return False
+                self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial = False
+            if self.state != 'closed':
+                self.state = 'closed'
+                _decide(self.service, 'circuit_closed')
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial = False
+            if self.state == 'half_open' or (
+                    self.state == 'closed'
+                    and self._failures >= self.failure_threshold):
+                self.state = 'open'
+                self._opened = time.monotonic()
+                _decide(self.service, 'circuit_open')
+
+    def end_trial(self):
+        """Let another trial call through after one ended without an
+        outcome (e.g. interrupted by KeyboardInterrupt)"""
+        with self._lock:
+            self._trial = False
+
+
+class RetryPolicy:
+    """Backoff, rate limiting and circuit breaking shared by all calls to
+    one service
+
+    Whole requests are retried by botocore in `retry_mode`; the policy
+    gates calls through the rate limiter and circuit breaker (call) and
+    spaces out retries of partial failures (backoff).
+    """
+
+    def __init__(self, service, retry_mode='standard', max_attempts=5,
+            retries=3, base_delay=0.05, max_delay=5.0, rate=None,
+            burst=None, failure_threshold=5, reset_timeout=30.0):
+        self.service = service
+        self.retry_mode = retry_mode
+        self.max_attempts = max_attempts
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter = TokenBucket(rate, burst) if rate else None
+        self.breaker = CircuitBreaker(
+            service, failure_threshold, reset_timeout)
+
+    def client_retries(self):
+        """Return the botocore Config retries option of the service"""
+        return {'mode': self.retry_mode, 'max_attempts': self.max_attempts}
+
+    def delay(self, attempt):
+        """Full jitter exponential backoff, so that concurrent callers
+        throttled together do not retry together"""
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def backoff(self, attempt):
+        """Sleep before retry `attempt` (counting from 0) of a partial
+        failure"""
+        _decide(self.service, 'retry')
+        time.sleep(self.delay(attempt))
+
+    def give_up(self):
+        _decide(self.service, 'give_up')
+
+    def acquire(self, tokens=1):
+        """Wait for the rate limiter and check the circuit breaker
+
+        :raises CircuitOpenError: The service keeps failing.
+        """
+        if not self.breaker.allow():
+            _decide(self.service, 'shed')
+            raise CircuitOpenError(
+                f'Circuit open for {self.service}, call not made')
+        if self.limiter is None:
+            return
+        try:
+            if self.limiter.acquire(tokens):
+                _decide(self.service, 'rate_limited')
+        except BaseException:
+            self.breaker.end_trial()
+            raise
+
+    def call(self, func, *args, **kwargs):
+        """Call func through the rate limiter and circuit breaker
+
+        Throttling errors and server-side failures that persist through
+        botocore's retries count as failures of the service; other errors
+        (e.g. invalid parameters) show that the service is answering.
+        """
+        self.acquire()
+        succeeded = None
+        try:
+            result = func(*args, **kwargs)
+            succeeded = True
+        except Exception as err:
+            succeeded = not is_retryable(err)
+            raise
+        finally:
+            if succeeded is None:
+                self.breaker.end_trial()
+            elif succeeded:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+        return result
+
+
+def _settings(service):
+    settings = dict(DEFAULT_POLICY)
+    settings.update(_SERVICE_POLICIES.get(service, {}))
+    settings.update(_overrides.get('*', {}))
+    settings.update(_overrides.get(service, {}))
+    return settings
+
+
+def get_policy(service):
+    """Return the shared retry policy of a boto3 service (e.g. 'sns')"""
+    policy = _policies.get(service)
+    if policy is None:
+        with _lock:
+            policy = _policies.get(service)
+            if policy is None:
+                policy = RetryPolicy(service, **_settings(service))
+                _policies[service] = policy
+    return policy
+
+
+def configure_policy(service=None, **settings):
+    """Override policy settings of a service (default: all services)
+
+    Policies and clients are recreated so the new settings take effect.
+    """
+    from client_manager import configure_clients
+
+    unknown = set(settings) - set(DEFAULT_POLICY)
+    if unknown:
+        raise ValueError(f'Unknown retry policy settings {sorted(unknown)}')
+    with _lock:
+        _overrides.setdefault(service or '*', {}).update(settings)
+        _policies.clear()
+    configure_clients()
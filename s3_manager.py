@@ -1,7 +1,9 @@
-import boto3
-from botocore.exceptions import ClientError
+from client_manager import get_resource
+from retry_manager import RETRYABLE_CODES, get_policy
 
+import os
 import sys
+import time
 import logging
 import uuid
 from pathlib import Path, PosixPath
@@ -13,11 +15,23 @@ logging.basicConfig(
 
 log = logging.getLogger()
 
-_s3_client = boto3.resource('s3')
+# Buckets known to exist (name -> expiry), so that get_bucket does not
+# list all buckets on every call of a long-running process
+_known_buckets = {}
+_BUCKET_CACHE_TTL = 300
+
+# DeleteObjects accepts at most 1000 keys per request
+_DELETE_BATCH_SIZE = 1000
+
+def _s3_client():
+    return get_resource('s3')
+
 
 def create_bucket(name, region=None):
+    from botocore.exceptions import ClientError
+    
     region = region or 'ap-southeast-1'
-    client = boto3.resource('s3', region_name=region)
+    client = get_resource('s3', region_name=region)
     params = {
         'Bucket': name,
         'CreateBucketConfiguration': {
@@ -32,17 +46,29 @@ def create_bucket(name, region=None):
         return False
 
 
+def iter_buckets():
+    """Yield the name and creation date of every bucket"""
+    for bucket in _s3_client().buckets.all():
+        yield {
+            'Name': bucket.name,
+            'CreationDate': bucket.creation_date
+        }
+
+
 def list_buckets():
     count = 0
-    for bucket in _s3_client.buckets.all():
+    for bucket in _s3_client().buckets.all():
         print(bucket.name)
         count += 1
     print(f'Found {count} buckets!')
     
     
 def get_bucket(name, create=False, region=None):
-    bucket = _s3_client.Bucket(name=name)
+    bucket = _s3_client().Bucket(name=name)
+    if _known_buckets.get(name, 0) > time.monotonic():
+        return bucket
     if bucket.creation_date:
+        _known_buckets[name] = time.monotonic() + _BUCKET_CACHE_TTL
         return bucket
 #        print(bucket.creation_date)
     else:
@@ -133,28 +159,65 @@ def delete_bucket_objects(bucket_name, key_prefix=None):
             'Key': obj.object_key,
             'VersionId': obj.version_id
         })
-        
-    bucket.delete_objects(Delete={
-        'Objects': targets,
-        'Quiet': True
-    })
-    
-    return len(targets)
+
+    failed = 0
+    for idx in range(0, len(targets), _DELETE_BATCH_SIZE):
+        failed += _delete_objects(
+            bucket, targets[idx:idx + _DELETE_BATCH_SIZE])
+    return len(targets) - failed
+
+
+def _delete_objects(bucket, targets):
+    """Delete up to 1000 object versions, retrying throttled and
+    server-side failures of single keys with backoff.
+
+    :returns: Number of object versions that could not be deleted.
+    :rtype: int
+    """
+    policy = get_policy('s3')
+    failed = 0
+    for attempt in range(policy.retries + 1):
+        res = policy.call(bucket.delete_objects, Delete={
+            'Objects': targets,
+            'Quiet': True
+        })
+        retry = []
+        for err in res.get('Errors', []):
+            if err.get('Code') in RETRYABLE_CODES:
+                target = {'Key': err['Key']}
+                if err.get('VersionId'):
+                    target['VersionId'] = err['VersionId']
+                retry.append(target)
+            else:
+                failed += 1
+                log.error(f'Cannot delete {err["Key"]}: {err.get("Message")}')
+        targets = retry
+        if not targets:
+            return failed
+        if attempt == policy.retries:
+            policy.give_up()
+            break
+        policy.backoff(attempt)
+    log.error(f'Cannot delete {len(targets)} objects after retries')
+    return failed + len(targets)
     
     
 def delete_buckets(name=None):
+    from botocore.exceptions import ClientError
+    
     count = 0
     if name:
         bucket = get_bucket(name)
         if bucket:
+            _known_buckets.pop(name, None)
             bucket.delete()
             bucket.wait_until_not_exists()
             count += 1
     else:
         count = 0
-        client = boto3.resource('s3')
-        for bucket in client.buckets.iterator():
+        for bucket in _s3_client().buckets.iterator():
             try:
+                _known_buckets.pop(bucket.name, None)
                 bucket.delete()
                 bucket.wait_until_not_exists()
                 count += 1
@@ -169,6 +232,51 @@ if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
     
+    parser.add_argument(
+        '--cwlogs_group',
+        help='Ship log records to this CloudWatch Logs group'
+    )
+    
+    parser.add_argument(
+        '--cwlogs_stream',
+        help='CloudWatch Logs stream for shipped log records\
+        (default: <hostname>-<pid>)'
+    )
+    
+    parser.add_argument(
+        '--daemon',
+        help='Forward the command to the daemon listening on this socket\
+        (default: $BOTO3_MANAGER_SOCKET)',
+        default=os.environ.get('BOTO3_MANAGER_SOCKET')
+    )
+    
+    parser.add_argument(
+        '--metrics',
+        help='Print per-operation API metrics to stderr at exit',
+        action='store_true',
+        default=False
+    )
+    
+    parser.add_argument(
+        '--metrics_format',
+        help='Format of printed metrics (default: text)',
+        choices=['text', 'json', 'prometheus'],
+        default='text'
+    )
+    
+    parser.add_argument(
+        '--output_format',
+        help='Format of listed records (default: ndjson)',
+        choices=['ndjson', 'jsonl', 'csv'],
+        default='ndjson'
+    )
+    
+    parser.add_argument(
+        '--fields',
+        help='Comma-separated fields of listed records to output,\
+        e.g. Name'
+    )
+    
     subparsers = parser.add_subparsers(
         title='Commands',
     )
@@ -338,12 +446,30 @@ if __name__ == '__main__':
     sp_delete_buckets.set_defaults(func=delete_buckets)
     
     args = parser.parse_args()
+    if args.metrics:
+        from metrics_manager import enable_metrics
+        enable_metrics(report=args.metrics_format)
+    if args.cwlogs_group:
+        from cwlogs_manager import enable_cwlogs_logging
+        enable_cwlogs_logging(args.cwlogs_group, args.cwlogs_stream)
+    
     action = args.func.__name__ if hasattr(args, 'func') else ''
     
+    # Commands reading local files by relative path always run locally
+    if args.daemon and action not in (
+            '', 'create_tempfile', 'create_bucket_object'):
+        from daemon_manager import remote
+        args.func = remote('s3', args.func, args.daemon)
+        iter_buckets = remote('s3', iter_buckets, args.daemon)
+        if action == 'get_bucket_object':
+            args.dest = os.path.abspath(args.dest or '.')
+    
     if action == 'create_bucket':
         args.func(args.name, args.region)
     elif action == 'list_buckets':
-        args.func()
+        from output_manager import write_records
+        write_records(iter_buckets(), args.output_format,
+            args.fields.split(',') if args.fields else None)
     elif action == 'get_bucket':
         args.func(args.name, args.create, args.region)
     elif action == 'create_tempfile':
@@ -359,8 +485,9 @@ if __name__ == '__main__':
     elif action == 'delete_buckets':
         args.func(args.bucket_name)
     else:
-        print('Invalid/Missing command.')
+        log.error('Invalid/Missing command.')
         sys.exit(1)
     
-    print('Done')
+    # On stderr, so listed records can be piped
+    log.info('Done')
 
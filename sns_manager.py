@@ -1,38 +1,228 @@
-import boto3
 import sys
+import os
+import json
+import time
+import threading
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-_sns_client = boto3.client('sns')
+from client_manager import get_client
+from retry_manager import CircuitOpenError, TokenBucket, get_policy
+
+log = logging.getLogger(__name__)
+
+
+def _sns_client():
+    return get_client('sns')
+
+
+# PublishBatch accepts at most 10 entries and 256 KiB of payload per request
+_PUBLISH_BATCH_SIZE = 10
+_PUBLISH_BATCH_BYTES = 256 * 1024
+
+# Local index of topic names -> ARNs (from ListTopics only) and, kept
+# apart, subscriptions of the topics they were asked for
+_SNS_INDEX_DIR = Path(os.environ.get(
+    'SNS_INDEX_DIR', Path.home() / '.cache' / 'boto3_manager'))
+_SNS_INDEX_TTL = 300
+
+# Subscribe/Unsubscribe are throttled per account at the low hundreds TPS
+_SUBSCRIBE_RATE = 50
 
 
 def create_sns_topic(topic_name):
-    _sns_client.create_topic(Name=topic_name)
+    _sns_client().create_topic(Name=topic_name)
+    invalidate_sns_index()
     return True
 
     
 def list_sns_topics(next_token=None):
     params = {'NextToken': next_token} if next_token else {}
-    topics = _sns_client.list_topics(**params)
+    topics = _sns_client().list_topics(**params)
     return topics.get('Topics', []), topics.get('NextToken', None)
 #    print(topics.get('Topics', []), topics.get('NextToken', None))
 
 
 def list_sns_subscriptions(next_token=None):
     params = {'NextToken': next_token} if next_token else {}
-    subscriptions = _sns_client.list_subscriptions(**params)
+    subscriptions = _sns_client().list_subscriptions(**params)
     return subscriptions.get('Subscriptions', []), \
         subscriptions.get('NextToken', None)
 #    print(subscriptions.get('Subscriptions', []), \
 #        subscriptions.get('NextToken', None))
 
 
+def iter_sns_topics():
+    """Yield all SNS topics, following NextToken across pages"""
+    paginator = _sns_client().get_paginator('list_topics')
+    for page in paginator.paginate():
+        yield from page.get('Topics', [])
+
+
+def iter_sns_subscriptions():
+    """Yield all SNS subscriptions, following NextToken across pages"""
+    paginator = _sns_client().get_paginator('list_subscriptions')
+    for page in paginator.paginate():
+        yield from page.get('Subscriptions', [])
+
+
+def iter_topic_subscriptions(topic_arn):
+    """Yield all subscriptions of a single SNS topic"""
+    paginator = _sns_client().get_paginator('list_subscriptions_by_topic')
+    for page in paginator.paginate(TopicArn=topic_arn):
+        yield from page.get('Subscriptions', [])
+
+
+def list_subscriptions_by_topics(topic_arns=None, max_workers=8):
+    """List subscriptions of several topics concurrently
+
+    :params topic_arns: ARNs of SNS topics (default: all topics)
+    :params type: list
+
+    :params max_workers: Maximum number of topics listed concurrently
+    :params type: int
+
+    :returns: Subscriptions keyed by topic ARN.
+    :rtype: dict
+    """
+    if topic_arns is None:
+        topic_arns = [t['TopicArn'] for t in iter_sns_topics()]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            lambda arn: list(iter_topic_subscriptions(arn)), topic_arns)
+        return dict(zip(topic_arns, results))
+
+
+def _sns_index_path(kind):
+    """Return the index file of a kind ('topics' or 'subscriptions') for
+    the current profile and region, so accounts do not share indexes"""
+    from client_manager import get_session
+
+    region = _sns_client().meta.region_name or 'default'
+    profile = get_session().profile_name
+    return _SNS_INDEX_DIR / f'sns_{kind}_{profile}_{region}.json'
+
+
+def _read_sns_index(kind):
+    try:
+        with open(_sns_index_path(kind)) as fh:
+            return json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_sns_index(kind, index):
+    """Atomically write an SNS index to the local cache"""
+    path = _sns_index_path(kind)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+    with open(tmp, 'w') as fh:
+        json.dump(index, fh)
+    os.replace(tmp, path)
+
+
+def invalidate_sns_index(topic_arn=None):
+    """Drop the cached subscriptions of a topic, or with no topic the
+    cached topic names"""
+    if topic_arn is None:
+        try:
+            _sns_index_path('topics').unlink()
+        except FileNotFoundError:
+            pass
+        return
+    index = _read_sns_index('subscriptions')
+    if index and index.pop(topic_arn, None) is not None:
+        _write_sns_index('subscriptions', index)
+
+
+def load_sns_topics(ttl=_SNS_INDEX_TTL, refresh=False):
+    """Return the cached topic name -> ARN map, listing the topics again
+    once it is older than ttl seconds or when refresh is set.
+    """
+    index = None if refresh else _read_sns_index('topics')
+    if index is None or time.time() - index.get('created', 0) >= ttl:
+        topic_arns = [t['TopicArn'] for t in iter_sns_topics()]
+        index = {
+            'created': time.time(),
+            'topics': {arn.split(':')[-1]: arn for arn in topic_arns}
+        }
+        _write_sns_index('topics', index)
+    return index['topics']
+
+
+def _index_subscriptions(subs):
+    return [
+        {
+            'SubscriptionArn': sub['SubscriptionArn'],
+            'Protocol': sub['Protocol'],
+            'Endpoint': sub['Endpoint']
+        } for sub in subs
+    ]
+
+
+def save_topic_subscriptions(subscriptions):
+    """Cache the subscriptions of topics, given as topic ARN ->
+    subscriptions, keeping the cached entries of other topics"""
+    index = _read_sns_index('subscriptions') or {}
+    now = time.time()
+    for topic_arn, subs in subscriptions.items():
+        index[topic_arn] = {
+            'created': now,
+            'subscriptions': _index_subscriptions(subs)
+        }
+    _write_sns_index('subscriptions', index)
+
+
+def load_topic_subscriptions(topic_arn, ttl=_SNS_INDEX_TTL, refresh=False):
+    """Return the cached subscriptions of one topic, listing them again
+    once they are older than ttl seconds or when refresh is set.
+    """
+    entry = None
+    if not refresh:
+        entry = (_read_sns_index('subscriptions') or {}).get(topic_arn)
+    if entry is not None and time.time() - entry['created'] < ttl:
+        return entry['subscriptions']
+    subs = _index_subscriptions(iter_topic_subscriptions(topic_arn))
+    save_topic_subscriptions({topic_arn: subs})
+    return subs
+
+
+def build_sns_index(max_workers=8):
+    """Rebuild the cached topic names and the subscriptions of all topics
+
+    :returns: Topic name -> ARN map and subscriptions keyed by topic ARN.
+    :rtype: dict
+    """
+    topics = load_sns_topics(refresh=True)
+    subscriptions = list_subscriptions_by_topics(
+        list(topics.values()), max_workers)
+    save_topic_subscriptions(subscriptions)
+    return {'topics': topics, 'subscriptions': subscriptions}
+
+
+def resolve_topic_arn(topic):
+    """Return the ARN of an SNS topic given either its name or ARN"""
+    if topic.startswith('arn:'):
+        return topic
+    arn = load_sns_topics().get(topic)
+    if arn is None:
+        # The topic may have been created since the index was built
+        arn = load_sns_topics(refresh=True).get(topic)
+    if arn is None:
+        raise KeyError(f'SNS topic {topic} does not exist.')
+    return arn
+
+
 def subscribe_sns_topic(topic_arn, mobile_number):
     params = {
         'TopicArn': topic_arn,
         'Protocol': 'sms',
         'Endpoint': mobile_number
     }
-    res = _sns_client.subscribe(**params)
-    print(res)
+    res = _sns_client().subscribe(**params)
+    log.info(res)
+    invalidate_sns_index(topic_arn)
     return True
 
 
@@ -41,22 +231,437 @@ def send_sns_message(topic_arn, message):
         'TopicArn': topic_arn,
         'Message': message
     }
-    res = _sns_client.publish(**params)
-    print(res)
+    res = get_policy('sns').call(_sns_client().publish, **params)
+    log.info(res)
     return True
+
+
+def read_sns_messages(file_path=None):
+    """Yield one message per non-empty line of file_path (default: stdin)"""
+    fh = sys.stdin if file_path in (None, '-') else open(file_path)
+    try:
+        for line in fh:
+            line = line.rstrip('\n')
+            if line:
+                yield line
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+
+
+def chunk_sns_messages(messages, on_rejected=None):
+    """Group messages into lists that fit a single PublishBatch request
+
+    Messages larger than a whole request can never be sent, so they are
+    left out and passed to on_rejected(position, message) instead.
+    """
+    batch, size = [], 0
+    for idx, message in enumerate(messages):
+        msg_size = len(message.encode('utf-8'))
+        if msg_size > _PUBLISH_BATCH_BYTES:
+            if on_rejected:
+                on_rejected(idx, message)
+            continue
+        if batch and (len(batch) == _PUBLISH_BATCH_SIZE
+                      or size + msg_size > _PUBLISH_BATCH_BYTES):
+            yield batch
+            batch, size = [], 0
+        batch.append(message)
+        size += msg_size
+    if batch:
+        yield batch
+
+
+def _publish_sns_batch(topic_arn, messages, retries=3):
+    """Publish up to 10 messages, retrying entries that failed server-side.
+
+    :returns: Number of sent and failed messages.
+    :rtype: tuple
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    policy = get_policy('sns')
+    entries = [
+        {'Id': str(idx), 'Message': message}
+        for idx, message in enumerate(messages)
+    ]
+    sent = failed = 0
+    for attempt in range(retries + 1):
+        try:
+            res = policy.call(
+                _sns_client().publish_batch,
+                TopicArn=topic_arn,
+                PublishBatchRequestEntries=entries
+            )
+        except CircuitOpenError as err:
+            # SNS keeps failing: shed the batch instead of retrying it
+            log.warning(f'PublishBatch failed: {err}')
+            break
+        except (ClientError, BotoCoreError) as err:
+            # e.g. a read timeout or closed connection after botocore's
+            # retries: the whole batch failed, but not for good
+            log.warning(f'PublishBatch failed: {err}')
+            res = {'Failed': [{'Id': e['Id']} for e in entries]}
+        sent += len(res.get('Successful', []))
+        # Sender faults (e.g. invalid parameters) will never succeed
+        retry_ids = {
+            f['Id'] for f in res.get('Failed', [])
+            if not f.get('SenderFault')
+        }
+        failed += len(res.get('Failed', [])) - len(retry_ids)
+        entries = [e for e in entries if e['Id'] in retry_ids]
+        if not entries:
+            break
+        if attempt == retries:
+            policy.give_up()
+            break
+        policy.backoff(attempt)
+    return sent, failed + len(entries)
+
+
+def publish_sns_batch(topic_arn, messages, max_in_flight=8, retries=3):
+    """Publish messages to an SNS topic using concurrent PublishBatch calls
+
+    :params topic_arn: ARN of SNS topic where to publish messages
+    :params type: str
+
+    :params messages: Iterable of messages, consumed lazily
+    :params type: iterable
+
+    :params max_in_flight: Maximum number of concurrent PublishBatch requests
+    :params type: int
+
+    :params retries: Number of retries for partially failed batches
+    :params type: int
+
+    :returns: Counts of sent and failed messages, elapsed seconds and rate.
+    :rtype: dict
+    """
+    sent = failed = 0
+    rejected = []
+
+    def reject(idx, message):
+        log.warning(f'Message {idx} is larger than the'
+                    f' {_PUBLISH_BATCH_BYTES} bytes of a PublishBatch request')
+        rejected.append(idx)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        pending = set()
+        for batch in chunk_sns_messages(messages, reject):
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    n_sent, n_failed = future.result()
+                    sent += n_sent
+                    failed += n_failed
+            pending.add(executor.submit(
+                _publish_sns_batch, topic_arn, batch, retries))
+        for future in pending:
+            n_sent, n_failed = future.result()
+            sent += n_sent
+            failed += n_failed
+    elapsed = time.monotonic() - start
+    return {
+        'sent': sent,
+        'failed': failed + len(rejected),
+        'elapsed': round(elapsed, 3),
+        'rate': round(sent / elapsed, 1) if elapsed else 0.0
+    }
     
     
+class SnsPublisher:
+    """Buffering SNS publisher for producers that publish in tight loops.
+
+    Messages are buffered per topic. Identical messages published to the
+    same topic within `dedup_window` seconds are dropped, and buffered
+    messages are merged into digest messages of at most `digest_bytes`
+    before being sent with PublishBatch. A background thread flushes the
+    buffers every `flush_interval` seconds or as soon as a topic has
+    `max_buffered` messages waiting.
+
+    Usage::
+
+        with SnsPublisher() as publisher:
+            publisher.publish(topic_arn, 'disk full on host-1')
+        print(publisher.stats())
+    """
+
+    def __init__(self, flush_interval=1.0, max_buffered=100,
+            dedup_window=60.0, digest_bytes=16 * 1024,
+            max_in_flight=4, retries=3):
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.dedup_window = dedup_window
+        self.digest_bytes = min(digest_bytes, _PUBLISH_BATCH_BYTES)
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self._buffers = {}
+        self._seen = {}
+        self._counters = dict.fromkeys([
+            'submitted', 'deduplicated', 'digests',
+            'published', 'failed', 'flushes'
+        ], 0)
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name='sns-publisher', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def publish(self, topic_arn, message):
+        """Buffer a message, returning False if it was deduplicated"""
+        now = time.monotonic()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('SnsPublisher is closed.')
+            self._counters['submitted'] += 1
+            key = (topic_arn, message)
+            if now - self._seen.get(key, float('-inf')) < self.dedup_window:
+                self._counters['deduplicated'] += 1
+                return False
+            self._seen[key] = now
+            buffer = self._buffers.setdefault(topic_arn, [])
+            buffer.append(message)
+            if len(buffer) >= self.max_buffered:
+                self._cond.notify()
+            return True
+
+    def stats(self):
+        """Return a snapshot of the publisher counters"""
+        with self._cond:
+            counters = dict(self._counters)
+            counters['buffered'] = sum(map(len, self._buffers.values()))
+        return counters
+
+    def flush(self):
+        """Publish all buffered messages now"""
+        # Keep flushes ordered when called from both the caller and the
+        # background thread: the buffers are taken under the flush lock,
+        # so a later flush cannot send newer messages before them
+        with self._flush_lock:
+            with self._cond:
+                buffers, self._buffers = self._buffers, {}
+                cutoff = time.monotonic() - self.dedup_window
+                self._seen = {
+                    k: t for k, t in self._seen.items() if t > cutoff}
+            for topic_arn, messages in buffers.items():
+                digests = list(self._digest(messages))
+                try:
+                    res = publish_sns_batch(topic_arn, digests,
+                        self.max_in_flight, self.retries)
+                except Exception as err:
+                    log.error(f'SNS flush failed: {err}')
+                    res = {'sent': 0, 'failed': len(digests)}
+                with self._cond:
+                    if len(messages) > 1:
+                        self._counters['digests'] += len(digests)
+                    self._counters['published'] += res['sent']
+                    self._counters['failed'] += res['failed']
+            with self._cond:
+                self._counters['flushes'] += 1
+
+    def close(self):
+        """Stop the background thread and flush remaining messages"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+
+    def _digest(self, messages):
+        """Merge messages into digests no larger than digest_bytes"""
+        if len(messages) == 1:
+            yield messages[0]
+            return
+        parts, size = [], 0
+        for message in messages:
+            msg_size = len(message.encode('utf-8')) + 1
+            if parts and size + msg_size > self.digest_bytes:
+                yield '\n'.join(parts)
+                parts, size = [], 0
+            parts.append(message)
+            size += msg_size
+        if parts:
+            yield '\n'.join(parts)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and not self._full():
+                    self._cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    def _full(self):
+        return any(len(b) >= self.max_buffered for b in self._buffers.values())
+
+
 def unsubscribe_sns_topic(subscription_arn):
     params = {
         'SubscriptionArn': subscription_arn
     }
-    res = _sns_client.unsubscribe(**params)
-    print(res)
+    res = _sns_client().unsubscribe(**params)
+    log.info(res)
+    # Subscription ARNs are the topic ARN followed by an id
+    invalidate_sns_index(subscription_arn.rsplit(':', 1)[0])
     return True
 
 
+def _write_results(results, results_file):
+    """Write result records as JSON lines and return counts per status"""
+    counts = {}
+    with open(results_file, 'w') as fh:
+        for result in results:
+            fh.write(json.dumps(result) + '\n')
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+    return counts
+
+
+def bulk_subscribe_sns_topic(topic_arn, endpoints, results_file,
+        protocol='sms', rate=_SUBSCRIBE_RATE, max_workers=16):
+    """Subscribe many endpoints to an SNS topic
+
+    Endpoints already subscribed according to the SNS index, and
+    duplicates of an endpoint being subscribed, are skipped.
+
+    :params topic_arn: ARN of SNS topic to subscribe to
+    :params type: str
+
+    :params endpoints: Endpoints (e.g. mobile numbers) to subscribe
+    :params type: iterable
+
+    :params results_file: Path of JSON lines file to write results to
+    :params type: str
+
+    :params rate: Maximum Subscribe calls per second
+    :params type: float
+
+    :params max_workers: Maximum number of concurrent Subscribe calls
+    :params type: int
+
+    :returns: Number of endpoints per status (subscribed/skipped/failed).
+    :rtype: dict
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    topic_subs = load_topic_subscriptions(topic_arn)
+    subscribed = {
+        sub['Endpoint'] for sub in topic_subs if sub['Protocol'] == protocol
+    }
+    bucket = TokenBucket(rate)
+    lock = threading.Lock()
+    # Endpoints with a Subscribe call under way; they only count as
+    # subscribed once it succeeds, so a failed endpoint can be retried
+    in_flight = set()
+
+    def subscribe(endpoint):
+        result = {'endpoint': endpoint}
+        with lock:
+            if endpoint in subscribed or endpoint in in_flight:
+                result['status'] = 'skipped'
+                return result
+            in_flight.add(endpoint)
+        bucket.acquire()
+        try:
+            res = _sns_client().subscribe(
+                TopicArn=topic_arn,
+                Protocol=protocol,
+                Endpoint=endpoint,
+                ReturnSubscriptionArn=True
+            )
+        except (ClientError, BotoCoreError) as err:
+            # One bad endpoint or dropped connection must not end the run
+            with lock:
+                in_flight.discard(endpoint)
+            result.update(status='failed', error=str(err))
+            return result
+        result.update(
+            status='subscribed',
+            subscription_arn=res['SubscriptionArn']
+        )
+        with lock:
+            in_flight.discard(endpoint)
+            subscribed.add(endpoint)
+            topic_subs.append({
+                'SubscriptionArn': res['SubscriptionArn'],
+                'Protocol': protocol,
+                'Endpoint': endpoint
+            })
+        return result
+
+    endpoints = (e.strip() for e in endpoints if e.strip())
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        counts = _write_results(
+            executor.map(subscribe, endpoints), results_file)
+    save_topic_subscriptions({topic_arn: topic_subs})
+    return counts
+
+
+def bulk_unsubscribe_sns_topic(subscription_arns, results_file,
+        rate=_SUBSCRIBE_RATE, max_workers=16):
+    """Delete many SNS subscriptions
+
+    :params subscription_arns: ARNs of SNS subscriptions to delete
+    :params type: iterable
+
+    :params results_file: Path of JSON lines file to write results to
+    :params type: str
+
+    :params rate: Maximum Unsubscribe calls per second
+    :params type: float
+
+    :params max_workers: Maximum number of concurrent Unsubscribe calls
+    :params type: int
+
+    :returns: Number of subscriptions per status (unsubscribed/failed).
+    :rtype: dict
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    bucket = TokenBucket(rate)
+    removed = set()
+
+    def unsubscribe(subscription_arn):
+        result = {'subscription_arn': subscription_arn}
+        bucket.acquire()
+        try:
+            _sns_client().unsubscribe(SubscriptionArn=subscription_arn)
+        except (ClientError, BotoCoreError) as err:
+            result.update(status='failed', error=str(err))
+            return result
+        result['status'] = 'unsubscribed'
+        removed.add(subscription_arn)
+        return result
+
+    arns = (a.strip() for a in subscription_arns if a.strip())
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        counts = _write_results(
+            executor.map(unsubscribe, arns), results_file)
+    index = _read_sns_index('subscriptions') or {}
+    for entry in index.values():
+        entry['subscriptions'] = [
+            sub for sub in entry['subscriptions']
+            if sub['SubscriptionArn'] not in removed
+        ]
+    if removed:
+        _write_sns_index('subscriptions', index)
+    return counts
+
+
 def delete_sns_topic(topic_arn):
-    _sns_client.delete_topic(TopicArn=topic_arn)
+    _sns_client().delete_topic(TopicArn=topic_arn)
+    invalidate_sns_index()
+    invalidate_sns_index(topic_arn)
     return True
 
             
@@ -65,6 +670,51 @@ if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
     
+    parser.add_argument(
+        '--cwlogs_group',
+        help='Ship log records to this CloudWatch Logs group'
+    )
+    
+    parser.add_argument(
+        '--cwlogs_stream',
+        help='CloudWatch Logs stream for shipped log records\
+        (default: <hostname>-<pid>)'
+    )
+    
+    parser.add_argument(
+        '--daemon',
+        help='Forward the command to the daemon listening on this socket\
+        (default: $BOTO3_MANAGER_SOCKET)',
+        default=os.environ.get('BOTO3_MANAGER_SOCKET')
+    )
+    
+    parser.add_argument(
+        '--metrics',
+        help='Print per-operation API metrics to stderr at exit',
+        action='store_true',
+        default=False
+    )
+    
+    parser.add_argument(
+        '--metrics_format',
+        help='Format of printed metrics (default: text)',
+        choices=['text', 'json', 'prometheus'],
+        default='text'
+    )
+    
+    parser.add_argument(
+        '--output_format',
+        help='Format of listed records (default: ndjson)',
+        choices=['ndjson', 'jsonl', 'csv'],
+        default='ndjson'
+    )
+    
+    parser.add_argument(
+        '--fields',
+        help='Comma-separated fields of listed records to output,\
+        e.g. TopicArn'
+    )
+    
     subparsers = parser.add_subparsers(
         title='Commands',
     )
@@ -96,8 +746,37 @@ if __name__ == '__main__':
         help='List SNS subscriptions'
     )
     
+    sp_list_sns_subscriptions.add_argument(
+        '--topic',
+        help='ARN or name of SNS topic to list subscriptions of\
+        (may be repeated; default: all subscriptions)',
+        action='append'
+    )
+    
+    sp_list_sns_subscriptions.add_argument(
+        '--max_workers',
+        help='Maximum number of topics listed concurrently (default: 8)',
+        type=int,
+        default=8
+    )
+    
     sp_list_sns_subscriptions.set_defaults(func=list_sns_subscriptions)
     
+    # Build SNS index subcommand
+    sp_build_sns_index = subparsers.add_parser(
+        'build_sns_index',
+        help='Rebuild the local SNS topic and subscription index'
+    )
+    
+    sp_build_sns_index.add_argument(
+        '--max_workers',
+        help='Maximum number of topics listed concurrently (default: 8)',
+        type=int,
+        default=8
+    )
+    
+    sp_build_sns_index.set_defaults(func=build_sns_index)
+    
     # Subscribe to SNS topic subcommand
     sp_subscribe_sns_topic = subparsers.add_parser(
         'subscribe_sns_topic',
@@ -106,7 +785,7 @@ if __name__ == '__main__':
     
     sp_subscribe_sns_topic.add_argument(
         'topic_arn',
-        help='ARN of SNS topic to subscribe to'
+        help='ARN or name of SNS topic to subscribe to'
     )
     
     sp_subscribe_sns_topic.add_argument(
@@ -124,7 +803,7 @@ if __name__ == '__main__':
     
     sp_send_sns_message.add_argument(
         'topic_arn',
-        help='ARN of SNS topic where to publish message'
+        help='ARN or name of SNS topic where to publish message'
     )
     
     sp_send_sns_message.add_argument(
@@ -134,6 +813,87 @@ if __name__ == '__main__':
     
     sp_send_sns_message.set_defaults(func=send_sns_message)
     
+    # Publish SNS messages in batches subcommand
+    sp_publish_sns_batch = subparsers.add_parser(
+        'publish_sns_batch',
+        help='Publish messages (one per line) to SNS topic in batches'
+    )
+    
+    sp_publish_sns_batch.add_argument(
+        'topic_arn',
+        help='ARN or name of SNS topic where to publish messages'
+    )
+    
+    sp_publish_sns_batch.add_argument(
+        '--file',
+        help='File with one message per line (default: stdin)',
+        default='-'
+    )
+    
+    sp_publish_sns_batch.add_argument(
+        '--max_in_flight',
+        help='Maximum number of concurrent PublishBatch requests\
+        (default: 8)',
+        type=int,
+        default=8
+    )
+    
+    sp_publish_sns_batch.add_argument(
+        '--retries',
+        help='Number of retries for failed messages (default: 3)',
+        type=int,
+        default=3
+    )
+    
+    sp_publish_sns_batch.set_defaults(func=publish_sns_batch)
+    
+    # Bulk subscribe to SNS topic subcommand
+    sp_bulk_subscribe_sns_topic = subparsers.add_parser(
+        'bulk_subscribe_sns_topic',
+        help='Subscribe endpoints (one per line) to an SNS topic'
+    )
+    
+    sp_bulk_subscribe_sns_topic.add_argument(
+        'topic_arn',
+        help='ARN or name of SNS topic to subscribe to'
+    )
+    
+    sp_bulk_subscribe_sns_topic.add_argument(
+        '--file',
+        help='File with one endpoint per line (default: stdin)',
+        default='-'
+    )
+    
+    sp_bulk_subscribe_sns_topic.add_argument(
+        '--protocol',
+        help='Subscription protocol (default: sms)',
+        default='sms'
+    )
+    
+    sp_bulk_subscribe_sns_topic.add_argument(
+        '--results_file',
+        help='JSON lines file where to write results\
+        (default: subscribe_results.jsonl)',
+        default='subscribe_results.jsonl'
+    )
+    
+    sp_bulk_subscribe_sns_topic.add_argument(
+        '--rate',
+        help=f'Maximum Subscribe calls per second\
+        (default: {_SUBSCRIBE_RATE})',
+        type=float,
+        default=_SUBSCRIBE_RATE
+    )
+    
+    sp_bulk_subscribe_sns_topic.add_argument(
+        '--max_workers',
+        help='Maximum number of concurrent Subscribe calls (default: 16)',
+        type=int,
+        default=16
+    )
+    
+    sp_bulk_subscribe_sns_topic.set_defaults(func=bulk_subscribe_sns_topic)
+    
     # Unsubscribe to SNS topic subcommand
     sp_unsubscribe_sns_topic = subparsers.add_parser(
         'unsubscribe_sns_topic',
@@ -147,6 +907,43 @@ if __name__ == '__main__':
     
     sp_unsubscribe_sns_topic.set_defaults(func=unsubscribe_sns_topic)
     
+    # Bulk unsubscribe to SNS topic subcommand
+    sp_bulk_unsubscribe_sns_topic = subparsers.add_parser(
+        'bulk_unsubscribe_sns_topic',
+        help='Delete SNS subscriptions (one ARN per line)'
+    )
+    
+    sp_bulk_unsubscribe_sns_topic.add_argument(
+        '--file',
+        help='File with one subscription ARN per line (default: stdin)',
+        default='-'
+    )
+    
+    sp_bulk_unsubscribe_sns_topic.add_argument(
+        '--results_file',
+        help='JSON lines file where to write results\
+        (default: unsubscribe_results.jsonl)',
+        default='unsubscribe_results.jsonl'
+    )
+    
+    sp_bulk_unsubscribe_sns_topic.add_argument(
+        '--rate',
+        help=f'Maximum Unsubscribe calls per second\
+        (default: {_SUBSCRIBE_RATE})',
+        type=float,
+        default=_SUBSCRIBE_RATE
+    )
+    
+    sp_bulk_unsubscribe_sns_topic.add_argument(
+        '--max_workers',
+        help='Maximum number of concurrent Unsubscribe calls (default: 16)',
+        type=int,
+        default=16
+    )
+    
+    sp_bulk_unsubscribe_sns_topic.set_defaults(
+        func=bulk_unsubscribe_sns_topic)
+    
     # Delete SNS topic subcommand
     sp_delete_sns_topic = subparsers.add_parser(
         'delete_sns_topic',
@@ -155,30 +952,87 @@ if __name__ == '__main__':
     
     sp_delete_sns_topic.add_argument(
         'topic_arn',
-        help='ARN of SNS topic to delete'
+        help='ARN or name of SNS topic to delete'
     )
     
     sp_delete_sns_topic.set_defaults(func=delete_sns_topic)
     
     args = parser.parse_args()
+    # Before any other handler, which would make basicConfig a no-op
+    logging.basicConfig(
+        level=logging.INFO,
+        format='[%(asctime)s] %(levelname)s %(module)s %(lineno)d - %(message)s'
+    )
+    if args.metrics:
+        from metrics_manager import enable_metrics
+        enable_metrics(report=args.metrics_format)
+    if args.cwlogs_group:
+        from cwlogs_manager import enable_cwlogs_logging
+        enable_cwlogs_logging(args.cwlogs_group, args.cwlogs_stream)
+    
     action = args.func.__name__ if hasattr(args, 'func') else ''
     
+    if args.daemon and action:
+        from daemon_manager import remote
+        args.func = remote('sns', args.func, args.daemon)
+        for name in ('iter_sns_topics', 'iter_sns_subscriptions',
+                'list_subscriptions_by_topics', 'resolve_topic_arn'):
+            globals()[name] = remote('sns', globals()[name], args.daemon)
+        if hasattr(args, 'results_file'):
+            args.results_file = os.path.abspath(args.results_file)
+    
+    fields = args.fields.split(',') if args.fields else None
+    
     if action == 'create_sns_topic':
         args.func(args.topic_name)
     elif action == 'list_sns_topics':
-        args.func()
+        from output_manager import write_records
+        write_records(iter_sns_topics(), args.output_format, fields)
     elif action == 'list_sns_subscriptions':
-        args.func()
+        from output_manager import write_records
+        if args.topic:
+            topic_arns = [resolve_topic_arn(t) for t in args.topic]
+            subscriptions = list_subscriptions_by_topics(
+                topic_arns, args.max_workers)
+            subs = (sub for subs in subscriptions.values() for sub in subs)
+        else:
+            subs = iter_sns_subscriptions()
+        write_records(subs, args.output_format, fields)
+    elif action == 'build_sns_index':
+        index = args.func(args.max_workers)
+        log.info(f'Indexed {len(index["topics"])} topics')
     elif action == 'subscribe_sns_topic':
-        args.func(args.topic_arn, args.mobile_number)
+        args.func(resolve_topic_arn(args.topic_arn), args.mobile_number)
+    elif action == 'bulk_subscribe_sns_topic':
+        counts = args.func(resolve_topic_arn(args.topic_arn),
+            read_sns_messages(args.file), args.results_file,
+            args.protocol, args.rate, args.max_workers)
+        log.info(counts)
+        if counts.get('failed'):
+            sys.exit(1)
     elif action == 'unsubscribe_sns_topic':
         args.func(args.subscription_arn)
+    elif action == 'bulk_unsubscribe_sns_topic':
+        counts = args.func(read_sns_messages(args.file), args.results_file,
+            args.rate, args.max_workers)
+        log.info(counts)
+        if counts.get('failed'):
+            sys.exit(1)
     elif action == 'send_sns_message':
-        args.func(args.topic_arn, args.message)
+        args.func(resolve_topic_arn(args.topic_arn), args.message)
+    elif action == 'publish_sns_batch':
+        stats = args.func(resolve_topic_arn(args.topic_arn),
+            read_sns_messages(args.file),
+            args.max_in_flight, args.retries)
+        log.info(f'Sent {stats["sent"]} messages ({stats["failed"]} failed)'
+                 f' in {stats["elapsed"]}s - {stats["rate"]} messages/sec')
+        if stats['failed']:
+            sys.exit(1)
     elif action == 'delete_sns_topic':
-        args.func(args.topic_arn)
+        args.func(resolve_topic_arn(args.topic_arn))
     else:
-        print('Invalid/Missing command.')
+        log.error('Invalid/Missing command.')
         sys.exit(1)
         
-    print('Done')
+    # On stderr, so listed records can be piped
+    log.info('Done')
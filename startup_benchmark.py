@@ -0,0 +1,239 @@
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_MANAGERS = (
+    's3_manager.py',
+    'dynamo_manager.py',
+    'sns_manager.py',
+    'cwlogs_manager.py',
+)
+
+_HERE = Path(__file__).resolve().parent
+
+# Commands run for real, with arguments naming resources the api_benchmark
+# stand-in answers for. Files are relative to a scratch directory.
+_TOPIC_ARN = 'arn:aws:sns:us-east-1:123456789012:benchmark-topic'
+_REAL_COMMANDS = {
+    's3_manager.py': [
+        ['list_buckets'],
+        ['get_bucket', 'benchmark-bucket'],
+        ['create_bucket_object', 'benchmark-bucket', 'object.txt'],
+        ['get_bucket_object', 'benchmark-bucket', 'object.txt',
+            '--dest', 'downloads'],
+        ['delete_bucket_objects', 'benchmark-bucket'],
+    ],
+    'dynamo_manager.py': [
+        ['query_products', 'benchmark-table', 'dress'],
+        ['scan_products', 'benchmark-table', 'in_stock', 'eq', 'true'],
+        ['create_dynamo_items', 'benchmark-table', '100'],
+    ],
+    'sns_manager.py': [
+        ['send_sns_message', _TOPIC_ARN, 'benchmark message'],
+        ['publish_sns_batch', _TOPIC_ARN, '--file', 'messages.txt'],
+    ],
+    'cwlogs_manager.py': [
+        ['filter_log_events', '/benchmark/app', 'ERROR',
+            '--start', '1700000000000', '--stop', '1700003600000'],
+    ],
+}
+
+# Installs the stand-in in a fresh interpreter, then runs the manager
+# script (if any) as __main__: python -c _LAUNCHER <latency> [script args]
+_LAUNCHER = """
+import runpy, sys
+from api_benchmark import StandIn
+from client_manager import add_client_hook
+add_client_hook(StandIn(latency=float(sys.argv[1])).install)
+if len(sys.argv) > 2:
+    sys.argv = sys.argv[2:]
+    runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+
+
+def list_commands(script):
+    """Return the subcommands of a manager script, parsed from its usage"""
+    res = subprocess.run(
+        [sys.executable, str(_HERE / script), '-h'],
+        capture_output=True, text=True
+    )
+    # The subcommand choices are the positional followed by '...', unlike
+    # the choices of options (e.g. --metrics_format)
+    match = re.search(r'\{([^}]+)\}\s+\.\.\.', res.stdout)
+    return match.group(1).split(',') if match else []
+
+
+def time_command(argv, repeat=5, env=None, cwd=_HERE, check=False):
+    """Run a command `repeat` times in fresh interpreters
+
+    :params env: Environment variables to set on top of os.environ, with
+    None removing a variable
+    :params type: dict
+
+    :params check: Raise RuntimeError if the command fails
+    :params type: bool
+
+    :returns: Wall-clock times in milliseconds.
+    :rtype: list
+    """
+    # Cold starts must not be able to reach AWS
+    env = dict(os.environ, AWS_EC2_METADATA_DISABLED='true', **(env or {}))
+    env = {name: value for name, value in env.items() if value is not None}
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = subprocess.run(argv, env=env, cwd=cwd,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        timings.append((time.perf_counter() - start) * 1000)
+        if check and res.returncode:
+            raise RuntimeError(f'Exit status {res.returncode}: '
+                f'{res.stderr.strip()[-500:]}')
+    return timings
+
+
+def _help_cases(scripts):
+    cases = [('python', [sys.executable, '-c', 'pass'])]
+    for script in scripts:
+        path = str(_HERE / script)
+        cases.append((f'{script} -h', [sys.executable, path, '-h']))
+        cases.append((f'{script} <invalid>', [sys.executable, path]))
+        for command in list_commands(script):
+            cases.append((
+                f'{script} {command} -h',
+                [sys.executable, path, command, '-h']
+            ))
+    return cases
+
+
+def _real_cases(scripts, latency):
+    launcher = [sys.executable, '-c', _LAUNCHER, str(latency)]
+    cases = [('python + stand-in', launcher)]
+    for script in scripts:
+        for command in _REAL_COMMANDS.get(script, []):
+            cases.append((
+                f'{script} {command[0]}',
+                launcher + [str(_HERE / script)] + command
+            ))
+    return cases
+
+
+def _prepare_workdir(workdir):
+    """Create the files the real commands read, and return the
+    environment they run in"""
+    with open(os.path.join(workdir, 'object.txt'), 'w') as fh:
+        fh.write('0' * 1024)
+    with open(os.path.join(workdir, 'messages.txt'), 'w') as fh:
+        fh.writelines(f'benchmark message {idx}\n' for idx in range(100))
+    os.makedirs(os.path.join(workdir, 'downloads'))
+    return {
+        'PYTHONPATH': str(_HERE),
+        # Dummy credentials, so no credential provider is searched and no
+        # real account can be used
+        'AWS_ACCESS_KEY_ID': 'standin',
+        'AWS_SECRET_ACCESS_KEY': 'standin',
+        'AWS_SESSION_TOKEN': None,
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'AWS_PROFILE': None,
+        'SNS_INDEX_DIR': os.path.join(workdir, 'sns_index'),
+    }
+
+
+def run_startup_benchmark(scripts=_MANAGERS, repeat=5, real=False,
+        latency=0.0):
+    """Measure cold-start time of every manager command
+
+    By default each command is run with --help so only interpreter
+    startup, imports and argument parsing are measured. An invalid
+    command and a bare interpreter are measured for reference.
+
+    With real, sample commands run to completion against the
+    api_benchmark stand-in, so the time to load botocore, create clients
+    and make the first calls is included. Each call waits `latency`
+    seconds instead of a network round trip. The interpreter loading the
+    stand-in is measured for reference.
+
+    :returns: One result per command with min/median milliseconds.
+    :rtype: list
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        if real:
+            cases = _real_cases(scripts, latency)
+            env = _prepare_workdir(workdir)
+        else:
+            cases = _help_cases(scripts)
+            env = None
+        for name, argv in cases:
+            try:
+                timings = time_command(argv, repeat, env,
+                    cwd=workdir if real else _HERE, check=real)
+            except RuntimeError as err:
+                raise RuntimeError(f'{name} failed. {err}') from None
+            results.append({
+                'command': name,
+                'min_ms': round(min(timings), 1),
+                'median_ms': round(statistics.median(timings), 1)
+            })
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Measure cold-start time of the manager CLIs'
+    )
+
+    parser.add_argument(
+        '--repeat',
+        help='Number of runs per command (default: 5)',
+        type=int,
+        default=5
+    )
+
+    parser.add_argument(
+        '--script',
+        help='Manager script to benchmark (may be repeated;\
+        default: all managers)',
+        action='append'
+    )
+
+    parser.add_argument(
+        '--real',
+        help='Run sample commands against the api_benchmark stand-in\
+        instead of measuring --help',
+        action='store_true',
+        default=False
+    )
+
+    parser.add_argument(
+        '--latency',
+        help='Seconds per stand-in call with --real (default: 0)',
+        type=float,
+        default=0.0
+    )
+
+    parser.add_argument(
+        '--json',
+        help='Print results as JSON',
+        action='store_true',
+        default=False
+    )
+
+    args = parser.parse_args()
+    results = run_startup_benchmark(args.script or _MANAGERS, args.repeat,
+        args.real, args.latency)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        width = max(len(r['command']) for r in results)
+        print(f'{"command":<{width}}  {"min ms":>8}  {"median ms":>9}')
+        for r in results:
+            print(f'{r["command"]:<{width}}  {r["min_ms"]:>8}'
+                  f'  {r["median_ms"]:>9}')